@@ -0,0 +1,206 @@
+"""In-process autocomplete over entities, agencies and dockets.
+
+Every name is normalized (lowercased, punctuation dropped) and indexed under
+itself and the start of each of its first few words, so "club" finds "Sierra
+Club".  Keys are kept sorted, so the names matching a prefix are one
+contiguous range found by two binary searches, and are then ranked by mention
+or document counts.  Ranking a huge range would mean walking all of it, so the
+top matches for every prefix that matches more than SCAN_LIMIT keys are worked
+out when the index is built.
+
+Building the index means reading every entity, agency and docket out of Mongo,
+so it isn't done by the web processes: the build_autocomplete command builds
+it and saves it to AUTOCOMPLETE_INDEX_PATH (run it from cron to keep it
+fresh), and the WSGI app loads the saved index at startup.  Each worker then
+checks the file every AUTOCOMPLETE_RELOAD_CHECK seconds from a background
+thread, and swaps in the new index whole when the file has changed.
+"""
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from django.conf import settings
+
+from regs_models import Entity, Agency, Docket
+
+import bisect, heapq, os, re, threading, time, logging, tempfile
+import cPickle as pickle
+
+AUTOCOMPLETE_INDEX_PATH = getattr(settings, 'AUTOCOMPLETE_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'sparerib_autocomplete.pickle'))
+AUTOCOMPLETE_RELOAD_CHECK = getattr(settings, 'AUTOCOMPLETE_RELOAD_CHECK', 60)
+
+log = logging.getLogger(__name__)
+
+# words of each name that get a key of their own
+INDEXED_WORDS = 4
+# prefixes matching more keys than this get their top matches precomputed
+SCAN_LIMIT = 500
+# how many matches to precompute, and so the most a request can ask for
+MAX_MATCHES = 25
+
+# the `type` parameter the front end sends, and the kinds of match it means
+TYPE_FILTERS = {'a': 'agency', 'o': 'submitter', 'd': 'docket'}
+
+_non_word = re.compile(r'[\W_]+', re.UNICODE)
+_word = re.compile(r'\S+', re.UNICODE)
+
+def normalize(text):
+    return _non_word.sub(' ', text.lower()).strip()
+
+
+class PrefixIndex(object):
+    """Sorted keys over (rank, type, value, label, names) items.
+
+    `keys` is sorted, and `key_items[i]` is the item `keys[i]` was made from;
+    `top` maps busy prefixes to their best items, per type and overall.
+    """
+    def __init__(self, items=()):
+        self.items = list(items)
+
+        pairs = []
+        for item_index, item in enumerate(self.items):
+            for name in item[4]:
+                words = normalize(name).split(' ')
+                for position in xrange(min(len(words), INDEXED_WORDS)):
+                    if words[position]:
+                        pairs.append((' '.join(words[position:]), item_index))
+        pairs = sorted(set(pairs))
+
+        self.keys = [pair[0] for pair in pairs]
+        self.key_items = [pair[1] for pair in pairs]
+
+        self.top = {}
+        for length in xrange(1, max(len(key) for key in self.keys) + 1 if self.keys else 1):
+            start = 0
+            busy = False
+            while start < len(self.keys):
+                if len(self.keys[start]) < length:
+                    start += 1
+                    continue
+
+                prefix = self.keys[start][:length]
+                end = bisect.bisect_left(self.keys, prefix + u'\uffff', start)
+                if end - start > SCAN_LIMIT:
+                    busy = True
+                    self.top[prefix] = dict((match_type, self._best(start, end, match_type)) for match_type in [None] + list(TYPE_FILTERS.values()))
+                start = end
+            # longer prefixes only match subsets of shorter ones, so once none are busy, none will be
+            if not busy:
+                break
+
+    def _best(self, start, end, match_type=None):
+        """Indexes of the best items of the given type (or any type) among keys[start:end]."""
+        item_indexes = set(self.key_items[start:end])
+        if match_type:
+            item_indexes = [index for index in item_indexes if self.items[index][1] == match_type]
+        return heapq.nlargest(MAX_MATCHES, item_indexes, key=lambda index: self.items[index][0])
+
+    def _matching(self, prefix, match_type=None):
+        if prefix in self.top:
+            return self.top[prefix][match_type]
+
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + u'\uffff', start)
+        return self._best(start, end, match_type)
+
+    def search(self, term, match_type=None, limit=10):
+        """Matches for the longest run of trailing words of `term` that matches anything.
+
+        The front end sends everything typed up to the caret, so only the end of it
+        is what's being completed; each match's `term` is the part of the input it
+        completes, which the front end swaps out when a match is picked.
+        """
+        for word in _word.finditer(term):
+            suffix = term[word.start():]
+            prefix = normalize(suffix)
+            if not prefix:
+                continue
+
+            best = self._matching(prefix, match_type)
+            if best:
+                return [{'label': self.items[index][3], 'value': self.items[index][2], 'type': self.items[index][1], 'term': suffix} for index in best[:limit]]
+        return []
+
+
+def load_items():
+    """(rank, type, value, label, names) for everything that can be autocompleted, from Mongo."""
+    items = []
+
+    entities = Entity._get_collection().find({'searchable': True}, ['aliases', 'stats.submitter_mentions.count', 'stats.text_mentions.count'])
+    for entity in entities:
+        if not entity.get('aliases'):
+            continue
+        stats = entity.get('stats', {})
+        rank = stats.get('submitter_mentions', {}).get('count', 0) + stats.get('text_mentions', {}).get('count', 0)
+        items.append((rank, 'submitter', entity['_id'], entity['aliases'][0], entity['aliases']))
+
+    for agency in Agency._get_collection().find({}, ['name', 'stats.count']):
+        names = [agency['_id']] + ([agency['name']] if agency.get('name') else [])
+        items.append((agency.get('stats', {}).get('count', 0), 'agency', agency['_id'], agency.get('name') or agency['_id'], names))
+
+    for docket in Docket._get_collection().find({}, ['title', 'stats.count']):
+        names = [docket['_id']] + ([docket['title']] if docket.get('title') else [])
+        items.append((docket.get('stats', {}).get('count', 0), 'docket', docket['_id'], docket.get('title') or docket['_id'], names))
+
+    return items
+
+def save_index(index, path=AUTOCOMPLETE_INDEX_PATH):
+    """Save an index for the web processes to load, replacing the old one in one step."""
+    state = (index.items, index.keys, index.key_items, index.top)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(path + '.tmp', path)
+
+def read_index(path=AUTOCOMPLETE_INDEX_PATH):
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+
+    index = PrefixIndex()
+    index.items, index.keys, index.key_items, index.top = state
+    return index
+
+_index = PrefixIndex()
+_index_mtime = None
+_watcher_pid = None
+_lock = threading.Lock()
+
+def load_index():
+    """Load the saved index if it's changed since it was last loaded; called at startup, then by each worker's watcher."""
+    global _index, _index_mtime
+
+    try:
+        mtime = os.path.getmtime(AUTOCOMPLETE_INDEX_PATH)
+        if mtime != _index_mtime:
+            _index, _index_mtime = read_index(), mtime
+    except Exception:
+        # keep serving the old index; the next check will try again
+        log.exception("Couldn't load the autocomplete index from %s; run build_autocomplete", AUTOCOMPLETE_INDEX_PATH)
+
+def _watch():
+    while True:
+        time.sleep(AUTOCOMPLETE_RELOAD_CHECK)
+        load_index()
+
+def get_index():
+    global _watcher_pid
+
+    # threads don't survive a fork, so each worker starts its own watcher the first time it's asked
+    if _watcher_pid != os.getpid():
+        with _lock:
+            if _watcher_pid != os.getpid():
+                if _index_mtime is None:
+                    load_index()
+
+                watcher = threading.Thread(target=_watch)
+                watcher.daemon = True
+                watcher.start()
+                _watcher_pid = os.getpid()
+    return _index
+
+
+class AutocompleteView(APIView):
+    def get(self, request):
+        limit = request.GET.get('limit', '10')
+        limit = min(int(limit), MAX_MATCHES) if limit.isdigit() else 10
+
+        matches = get_index().search(request.GET.get('term', ''), TYPE_FILTERS.get(request.GET.get('type', None), None), limit)
+        return Response({'matches': matches})
@@ -0,0 +1,4 @@
+"""Benchmark-only helpers.
+
+Nothing in the app imports this package; only the benchmark commands do.
+"""
@@ -0,0 +1,230 @@
+"""A synthetic stand-in for the analysis corpus, for benchmarking the clustering views.
+
+SyntheticCorpus generates a docket of a given size in which a `duplication`
+fraction of the documents are lightly edited copies of form letters, and
+answers the parts of the analysis.corpus API the clustering views use.  Text
+and metadata are derived from the document ID on demand, so even very large
+dockets cost little more than their form-letter assignments.
+
+stand_in() swaps the corpus, the hierarchy store, the docket models and the
+caches the clustering views depend on for in-process versions, so the views
+can be run end to end without Postgres, Mongo or memcached.  The swap only
+lasts for its with block, and the app modules aren't even imported until then.
+"""
+from django.core.cache import get_cache
+
+from sparerib_api.cache import LRUCache
+
+from collections import namedtuple
+from contextlib import contextmanager
+import itertools, random, string
+
+Bounds = namedtuple('Bounds', ['start', 'end'])
+
+# cutoffs the synthetic hierarchy has clusters at; each level merges pairs of groups from the level below
+LEVELS = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+SENTENCE_WORDS = 12
+
+
+class SyntheticCorpus(object):
+    def __init__(self, size, duplication=0.5, form_size=25, words=300, edit_rate=0.05, seed=0):
+        self.id = size
+        self.docket_id = "SYNTH-%d" % size
+        self.size = size
+        self.words = words
+        self.edit_rate = edit_rate
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self.vocabulary = [''.join(rng.choice(string.ascii_lowercase) for i in xrange(rng.randint(2, 10))) for j in xrange(2000)]
+
+        # document IDs run from 1 to size; form letters are skewed so a few are very popular, like real campaigns
+        form_count = max(1, int(size * duplication / form_size))
+        self.form = {}
+        self.forms = {}
+        for doc_id in xrange(1, size + 1):
+            if rng.random() < duplication:
+                form = int(form_count * rng.random() ** 2)
+                self.form[doc_id] = form
+                self.forms.setdefault(form, []).append(doc_id)
+
+        self._form_words = {}
+
+    def _words(self, doc_id):
+        form = self.form.get(doc_id)
+        if form is None:
+            rng = random.Random("%s-doc-%s" % (self.seed, doc_id))
+            return [rng.choice(self.vocabulary) for i in xrange(self.words)], set()
+
+        if form not in self._form_words:
+            rng = random.Random("%s-form-%s" % (self.seed, form))
+            self._form_words[form] = [rng.choice(self.vocabulary) for i in xrange(self.words)]
+
+        words = list(self._form_words[form])
+        rng = random.Random("%s-edit-%s" % (self.seed, doc_id))
+        edited = set()
+        for position in xrange(len(words)):
+            if rng.random() < self.edit_rate:
+                words[position] = rng.choice(self.vocabulary)
+                edited.add(position // SENTENCE_WORDS)
+        return words, edited
+
+    def _sentences(self, doc_id):
+        """The document's text, plus the bounds of each sentence and whether it was edited away from the form."""
+        words, edited = self._words(doc_id)
+        sentences, parts, cursor = [], [], 0
+        for index in xrange(0, len(words), SENTENCE_WORDS):
+            sentence = ' '.join(words[index:index + SENTENCE_WORDS]).capitalize() + '. '
+            parts.append(sentence)
+            sentences.append((Bounds(cursor, cursor + len(sentence) - 1), index // SENTENCE_WORDS in edited))
+            cursor += len(sentence)
+        return ''.join(parts)[:10000], sentences
+
+    def _metadata(self, doc_id):
+        rng = random.Random("%s-meta-%s" % (self.seed, doc_id))
+        return {
+            'document_id': "%s-%07d" % (self.docket_id, doc_id),
+            'title': "Comment from %s" % rng.choice(self.vocabulary).capitalize(),
+            'submitter_name': "%s %s" % (rng.choice(self.vocabulary).capitalize(), rng.choice(self.vocabulary).capitalize()),
+            'submitter_organization': rng.choice(self.vocabulary).capitalize() if rng.random() < 0.2 else None
+        }
+
+    def hierarchy(self, require_summaries=False):
+        def clusters(level, forms):
+            if level == len(LEVELS):
+                return []
+
+            out = []
+            shift = len(LEVELS) - 1 - level
+            for key, group in itertools.groupby(forms, lambda form: form >> shift):
+                group = list(group)
+                members = sorted(itertools.chain(*[self.forms[form] for form in group]))
+                if len(members) < 2:
+                    continue
+                out.append({
+                    'name': members[0],
+                    'cutoff': LEVELS[level],
+                    'size': len(members),
+                    'members': members,
+                    'children': clusters(level + 1, group)
+                })
+            return out
+
+        return clusters(0, sorted(self.forms))
+
+    def doc(self, doc_id):
+        return {'text': self._sentences(doc_id)[0], 'metadata': self._metadata(doc_id)}
+
+    def doc_metadatas(self, doc_ids):
+        return [(doc_id, self._metadata(doc_id)) for doc_id in doc_ids]
+
+    def docs_by_metadata(self, field, value):
+        if field == 'document_id' and value.startswith(self.docket_id + '-'):
+            doc_id = int(value[len(self.docket_id) + 1:])
+            if 1 <= doc_id <= self.size:
+                return [doc_id]
+        return []
+
+    def phrase_overlap(self, doc_id, doc_ids):
+        # every unedited sentence of a form letter is shared with the other copies of that form in the set
+        form = self.form.get(doc_id)
+        if form is None:
+            return {}
+        count = sum(1 for other in doc_ids if self.form.get(other) == form)
+
+        text, sentences = self._sentences(doc_id)
+        return dict((index, {'count': count, 'indexes': [bounds]}) for index, (bounds, edited) in enumerate(sentences) if not edited)
+
+
+class MemoryCollection(object):
+    """Just enough of a pymongo collection for the hierarchy store."""
+    def __init__(self):
+        self.records = {}
+
+    def _matches(self, record, spec):
+        return all(record.get(key) == value for key, value in spec.items())
+
+    def update(self, spec, document, upsert=False, **kwargs):
+        record = self.records.get(spec['_id'])
+        if record is None:
+            if not upsert:
+                return
+            record = self.records[spec['_id']] = {'_id': spec['_id']}
+        record.update(document.get('$set', {}))
+        for key, value in document.get('$inc', {}).items():
+            record[key] = record.get(key, 0) + value
+
+    def find_one(self, spec, fields=None):
+        record = self.records.get(spec['_id'])
+        if record is None or not self._matches(record, spec):
+            return None
+        return dict((key, value) for key, value in record.items() if fields is None or key in fields or key == '_id')
+
+
+class Record(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class RecordSet(object):
+    """Just enough of a mongoengine queryset for the models the clustering views read."""
+    def __init__(self, records):
+        self.records = records
+
+    def __call__(self, **query):
+        return RecordSet([record for record in self.records if all(getattr(record, key) == value for key, value in query.items())])
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def only(self, *fields):
+        return self
+
+    def get(self, **query):
+        return next(iter(self(**query)))
+
+class SyntheticDocs(RecordSet):
+    """Document records for a SyntheticCorpus, made up as they're asked for."""
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def get(self, id):
+        doc_ids = self.corpus.docs_by_metadata('document_id', id)
+        if not doc_ids:
+            raise KeyError(id)
+        return Record(id=id, docket_id=self.corpus.docket_id)
+
+def model(records):
+    return Record(objects=records if isinstance(records, RecordSet) else RecordSet(records))
+
+
+@contextmanager
+def stand_in(corpus):
+    """Point the clustering views at `corpus` and in-process stores for the duration of the block."""
+    from sparerib_api import clustering, hierarchies
+
+    collection = MemoryCollection()
+    docket = Record(id=corpus.docket_id, agency='SYNTH', stats={'count': corpus.size, 'date_range': None})
+    replacements = [
+        (clustering, 'get_dual_corpora_by_metadata', lambda field, value: corpus if value == corpus.docket_id else None),
+        (clustering, 'corpus_version', lambda corpus: "%s-synthetic" % corpus.id),
+        (clustering, 'version_cache', LRUCache(10000)),
+        (clustering, 'frequency_cache', LRUCache(clustering.frequency_cache.max_weight, weigh=clustering.frequency_cache.weigh)),
+        (clustering, 'cache', get_cache('django.core.cache.backends.locmem.LocMemCache', LOCATION='sparerib-synthetic-%s' % corpus.id, OPTIONS={'MAX_ENTRIES': 10 * corpus.size})),
+        (clustering, 'postgres', Record(ensure_registered=lambda connection: None)),
+        (clustering, 'Docket', model([docket])),
+        (clustering, 'Agency', model([Record(id='SYNTH', name='Synthetic Agency')])),
+        (clustering, 'Doc', model(SyntheticDocs(corpus))),
+        (hierarchies, '_collection', lambda: collection),
+        (hierarchies, '_loaded', LRUCache(hierarchies._loaded.max_weight, weigh=hierarchies._loaded.weigh)),
+        (hierarchies, '_hits', {}),
+    ]
+
+    originals = [(module, name, getattr(module, name)) for module, name, value in replacements]
+    for module, name, value in replacements:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
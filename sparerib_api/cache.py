@@ -13,3 +13,54 @@ def cache(seconds = 900):
                 return result
         return x
     return doCache
+
+from collections import OrderedDict
+import threading, time
+
+class LRUCache(object):
+    """A thread-safe, in-process cache bounded by the total weight of its contents.
+
+    `weigh` maps a value to its weight (1 per entry by default); once the total
+    goes over `max_weight`, least-recently-used entries are evicted.  Values
+    heavier than `max_weight` on their own are never stored.  If `ttl` is set,
+    entries also expire that many seconds after they were stored.
+    """
+    def __init__(self, max_weight, weigh=lambda value: 1, ttl=None):
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, weight, expires = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if expires is not None and expires < time.time():
+                self._weight -= weight
+                return default
+
+            self._data[key] = (value, weight, expires)
+            return value
+
+    def set(self, key, value):
+        weight = self.weigh(value)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._weight -= self._data.pop(key)[1]
+            if weight > self.max_weight:
+                return
+
+            self._data[key] = (value, weight, expires)
+            self._weight += weight
+            while self._weight > self.max_weight:
+                evicted_key, evicted = self._data.popitem(last=False)
+                self._weight -= evicted[1]
+
+    def __len__(self):
+        return len(self._data)
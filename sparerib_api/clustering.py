@@ -1,30 +1,40 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from analysis.corpus import get_dual_corpora_by_metadata, find_doc_in_hierarchy, trace_doc_in_hierarchy
+from analysis.corpus import get_dual_corpora_by_metadata
 from analysis.utils import profile
+from hierarchies import get_hierarchy, loaded_hierarchy, record_request, corpus_version
+from intervals import phrase_intervals, max_coverage_runs
+from cache import LRUCache
 from django.conf import settings
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.core.cache import cache
 
 from django.db import connection
-import psycopg2.extras
-
-import itertools
-try:
-    import numpypy
-except:
-    pass
-import numpy
+import postgres
 
 from regs_models import *
 
+import json, math
+
 DEFAULT_CUTOFF = getattr(settings, 'DEFAULT_CLUSTER_CUTOFF', 0.9)
 
+# frequency runs for (docket, corpus version, cluster, cutoff, document), bounded by the total number of runs held
+frequency_cache = LRUCache(getattr(settings, 'PHRASE_OVERLAP_CACHE_SIZE', 1000000), weigh=lambda runs: len(runs[0]))
+
+# corpus fingerprints by docket ID; a slightly stale one just means serving the previous hierarchy a little longer
+version_cache = LRUCache(10000, ttl=getattr(settings, 'CORPUS_VERSION_TTL', 60))
+
+# per-document metadata needed for cluster member lists
+METADATA_FIELDS = ('title', 'submitter_name', 'submitter_organization')
+METADATA_BATCH_SIZE = 1000
+METADATA_CACHE_TIMEOUT = getattr(settings, 'DOC_METADATA_CACHE_TIMEOUT', 86400)
+
 
 class CommonClusterView(APIView):
     _cutoff = None
     _clusters = None
     _corpus = None
+    _version = None
 
     @property
     def cutoff(self):
@@ -38,21 +48,31 @@ class CommonClusterView(APIView):
     @property
     def corpus(self):
         if self._corpus is None:
+            # make sure the fancy postgres stuff works right; normally this already happened when the connection was opened
+            postgres.ensure_registered(connection)
+
             self._corpus = get_dual_corpora_by_metadata('docket_id', self.kwargs['docket_id'])
             if not self._corpus:
                 # todo: better error handling
                 raise Http404("Couldn't find analysis for docket %s" % self.kwargs['docket_id'])
         return self._corpus
 
-    def dispatch(self, *args, **kwargs):
-        # make sure the fancy postgres stuff works right
-        connection.cursor()
-        psycopg2.extras.register_hstore(connection.connection)
-        psycopg2.extras.register_composite('int_bounds', connection.connection)
-
-        return super(CommonClusterView, self).dispatch(*args, **kwargs)
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = version_cache.get(self.kwargs['docket_id'])
+            if self._version is None:
+                self._version = corpus_version(self.corpus)
+                version_cache.set(self.kwargs['docket_id'], self._version)
+        return self._version
 
+    def hierarchy(self, require_summaries=False, **parts):
+        docket_id = self.kwargs['docket_id']
+        record_request(docket_id, require_summaries)
 
+        # a hierarchy that's already in memory doesn't need the corpus, so don't look it up
+        return loaded_hierarchy(docket_id, require_summaries, self.version) or \
+            get_hierarchy(docket_id, self.corpus, require_summaries, self.version, **parts)
 
 
 class DocketHierarchyView(CommonClusterView):
@@ -60,14 +80,13 @@ class DocketHierarchyView(CommonClusterView):
     def get(self, request, docket_id):
         docket = Docket.objects.get(id=docket_id)
 
-        hierarchy = self.corpus.hierarchy(request.GET.get('require_summaries', "").lower()=="true")
-        total_clustered = sum([cluster['size'] for cluster in hierarchy])
+        hierarchy = self.hierarchy(request.GET.get('require_summaries', "").lower()=="true")
         
         out = {
-            'cluster_hierarchy': sorted(hierarchy, key=lambda x: x['size'], reverse=True),
+            'cluster_hierarchy': sorted(hierarchy.serialize(), key=lambda x: x['size'], reverse=True),
             'stats': {
-                'clustered': total_clustered,
-                'unclustered': docket.stats['count'] - total_clustered if 'count' in docket.stats else None,
+                'clustered': hierarchy.clustered,
+                'unclustered': docket.stats['count'] - hierarchy.clustered if 'count' in docket.stats else None,
                 'date_range': docket.stats['date_range'] if 'date_range' in docket.stats else None
             },
             'prepopulate': None
@@ -89,36 +108,19 @@ class DocketHierarchyView(CommonClusterView):
         # choose a cluster and document to prepopulate if one hasn't been requested
         prepop = int(request.GET.get('prepopulate_document', -1))
         if prepop > -1:
-            pp_cluster = find_doc_in_hierarchy(hierarchy, prepop, self.cutoff)
+            pp_cluster = hierarchy.locate(prepop, self.cutoff)
             if pp_cluster:
                 out['prepopulate'] = {
                     'document': prepop,
-                    'cluster': pp_cluster['name'],
-                    'cutoff': self.cutoff
+                    'cluster': pp_cluster[1],
+                    'cutoff': pp_cluster[0]
                 }
         if not out['prepopulate'] and out['stats']['clustered'] > 0:
-            pp_cluster = find_doc_in_hierarchy(hierarchy, out['cluster_hierarchy'][0]['name'], out['cluster_hierarchy'][0]['cutoff'])
-            out['prepopulate'] = {
-                'document': pp_cluster['members'][0],
-                'cluster': pp_cluster['name'],
-                'cutoff': out['cluster_hierarchy'][0]['cutoff']
-            }
-
-        remove_members(out['cluster_hierarchy'])
+            # the biggest top-level cluster, worked out when the hierarchy was built
+            out['prepopulate'] = hierarchy.prepopulate
 
         return Response(out)
 
-def remove_members(hierarchy):
-    """Remove doc IDs from cluster hierarchy.
-
-    IDs are needed for some internal operations, but aren't
-    needed in browser. Large dockets could have tense of thousands
-    of IDs, making API results unnecessarily large if not removed.
-    """
-    for c in hierarchy:
-        del c['members']
-        remove_members(c['children'])
-
 
 class HierarchyTeaserView(CommonClusterView):
     @profile
@@ -129,12 +131,13 @@ class HierarchyTeaserView(CommonClusterView):
         else:
             self.kwargs['docket_id'] = item_id
 
-        hierarchy = self.corpus.hierarchy()
+        # counts are precomputed, and documents only need the index, so never load cluster members
+        hierarchy = self.hierarchy(with_index=item_type == 'document', with_members=False)
 
         out = {
             'docket_teaser': {
-                '0.5': {'count': self._count_clusters(hierarchy, 0.5)},
-                '0.8': {'count': self._count_clusters(hierarchy, 0.8)}
+                '0.5': {'count': hierarchy.count(0.5)},
+                '0.8': {'count': hierarchy.count(0.8)}
             }
         }
 
@@ -145,60 +148,119 @@ class HierarchyTeaserView(CommonClusterView):
                 out['document_teaser'] = {}
                 doc_id = docs[0]
 
-                cluster05 = find_doc_in_hierarchy(hierarchy, doc_id, 0.5)
+                cluster05 = hierarchy.locate(doc_id, 0.5)
                 if cluster05:
-                    out['document_teaser'] = {'0.5': {'count': cluster05['size'], 'id': doc_id}}
+                    out['document_teaser'] = {'0.5': {'count': cluster05[2], 'id': doc_id}}
                     
-                    cluster08 = find_doc_in_hierarchy(hierarchy, doc_id, 0.8)
+                    cluster08 = hierarchy.locate(doc_id, 0.8)
                     if cluster08:
-                        out['document_teaser']['0.8'] = {'count': cluster08['size'], 'id': doc_id}
+                        out['document_teaser']['0.8'] = {'count': cluster08[2], 'id': doc_id}
 
         return Response(out)
 
-    def _count_clusters(self, hierarchy, cutoff):
-        count = 0
-
-        for cluster in hierarchy:
-            if cluster['cutoff'] == cutoff:
-                count += 1
-
-            if cluster['cutoff'] < cutoff:
-                count += self._count_clusters(cluster['children'], cutoff)
-
-        return count
-
 
 class SingleClusterView(CommonClusterView):
+    # page sizes, if paging; clients that want everything can stream instead
+    limit = 100
+    max_limit = 1000
+    stream_chunk_size = 500
+
     @profile
     def get(self, request, docket_id, cluster_id):
         cluster_id = int(cluster_id)
         
-        h = self.corpus.hierarchy()
-        cluster = find_doc_in_hierarchy(h, cluster_id, self.cutoff)
-
-        # consider caching for very large clusters
-        _metadatas = lambda: dict(self.corpus.doc_metadatas(cluster['members']))
-        members = tuple(cluster['members'])
-        if len(members) > 1000:
-            key = 'sparerib_api.clustering.cluster-%s-%s-%s' % (docket_id, cluster_id, hash(members))
-            
-            metadatas = cache.get(key)
-            if not metadatas:
-                metadatas = _metadatas()
-                cache.set(key, metadatas)
-        else:
-            # it's little; don't cache
-            metadatas = _metadatas()
+        cluster = self.hierarchy().find(cluster_id, self.cutoff)
+        if not cluster:
+            raise Http404("Cluster not found")
+
+        if request.GET.get('stream', '').lower() == 'true':
+            return StreamingHttpResponse(self.stream_documents(cluster), content_type='application/json')
+
+        if 'page' in request.GET or 'limit' in request.GET:
+            return Response(self.paginate_documents(cluster))
+
+        metadatas = self.doc_metadatas(cluster['members'])
 
         return Response({
             'id': cluster['name'],
-            'documents': [{
-                'id': doc_id,
-                'title': metadatas[doc_id]['title'],
-                'submitter': ', '.join([metadatas[doc_id][field] for field in ['submitter_name', 'submitter_organization'] if field in metadatas[doc_id] and metadatas[doc_id][field]])
-            } for doc_id in cluster['members']]
+            'documents': [cluster_document(doc_id, metadatas[doc_id]) for doc_id in cluster['members']]
         })
 
+    def doc_metadatas(self, doc_ids):
+        """Title and submitter metadata for doc_ids, from the cache where possible.
+
+        Entries are per document, so every cutoff and every overlapping cluster
+        shares them, and only the IDs that aren't cached yet go to the corpus.
+        """
+        key_for = lambda doc_id: 'sparerib_api.clustering.doc-%s-%s-%s' % (self.kwargs['docket_id'], self.version, doc_id)
+
+        metadatas = {}
+        for start in xrange(0, len(doc_ids), METADATA_BATCH_SIZE):
+            batch = dict((key_for(doc_id), doc_id) for doc_id in doc_ids[start:start + METADATA_BATCH_SIZE])
+            metadatas.update((batch[key], value) for key, value in cache.get_many(batch.keys()).iteritems())
+
+            missing = [doc_id for doc_id in batch.values() if doc_id not in metadatas]
+            if missing:
+                fetched = dict((doc_id, dict((field, metadata[field]) for field in METADATA_FIELDS if field in metadata)) for doc_id, metadata in self.corpus.doc_metadatas(missing))
+                cache.set_many(dict((key_for(doc_id), metadata) for doc_id, metadata in fetched.iteritems()), METADATA_CACHE_TIMEOUT)
+                metadatas.update(fetched)
+
+        return metadatas
+
+    def get_limit(self):
+        try:
+            return max(1, min(int(self.request.GET.get('limit', self.limit)), self.max_limit))
+        except ValueError:
+            return self.limit
+
+    def url_with_page_number(self, page_number):
+        params = self.request.GET.copy()
+        params['page'] = page_number
+        return "%s?%s" % (self.request.path, params.urlencode())
+
+    def paginate_documents(self, cluster):
+        """Metadata for one page of a cluster's members, fetching only that page's documents."""
+        try:
+            page = max(int(self.request.GET.get('page', '1')), 1)
+        except ValueError:
+            page = 1
+        limit = self.get_limit()
+
+        members = cluster['members']
+        page_count = int(math.ceil(float(len(members)) / limit))
+        page_members = members[(page - 1) * limit:page * limit]
+        metadatas = self.doc_metadatas(page_members)
+
+        return {
+            'id': cluster['name'],
+            'documents': [cluster_document(doc_id, metadatas[doc_id]) for doc_id in page_members],
+            'next': self.url_with_page_number(page + 1) if page < page_count else None,
+            'page': page,
+            'pages': page_count,
+            'per_page': limit,
+            'previous': self.url_with_page_number(page - 1) if page > 1 else None,
+            'total': len(members)
+        }
+
+    def stream_documents(self, cluster):
+        """Generate the full JSON response a chunk of members at a time, so it's never all in memory."""
+        yield '{"id": %s, "documents": [' % json.dumps(cluster['name'])
+
+        members = cluster['members']
+        for start in xrange(0, len(members), self.stream_chunk_size):
+            chunk = members[start:start + self.stream_chunk_size]
+            metadatas = self.doc_metadatas(chunk)
+            yield (', ' if start else '') + ', '.join(json.dumps(cluster_document(doc_id, metadatas[doc_id])) for doc_id in chunk)
+
+        yield ']}'
+
+def cluster_document(doc_id, metadata):
+    return {
+        'id': doc_id,
+        'title': metadata['title'],
+        'submitter': ', '.join([metadata[field] for field in ['submitter_name', 'submitter_organization'] if field in metadata and metadata[field]])
+    }
+
 
 class DocumentClusterView(CommonClusterView):
     @profile
@@ -206,26 +268,27 @@ class DocumentClusterView(CommonClusterView):
         document_id = int(document_id)
         cluster_id = int(cluster_id)
 
-        h = self.corpus.hierarchy()
-        cluster = find_doc_in_hierarchy(h, cluster_id, self.cutoff)['members']
+        hierarchy = self.hierarchy()
+        cluster = hierarchy.find(cluster_id, self.cutoff)['members']
 
         doc = self.corpus.doc(document_id)
         text = doc['text']
-        raw_phrases = self.corpus.phrase_overlap(document_id, cluster)
-        
-        frequencies = numpy.zeros(len(text), 'l')
-        for phrase in raw_phrases.values():
-            for occurrence in phrase['indexes']:
-                frequencies[occurrence.start:occurrence.end] = numpy.maximum(frequencies[occurrence.start:occurrence.end], phrase['count'])
 
-        freq_ranges = [(f[0], len(list(f[1]))) for f in itertools.groupby(frequencies)]
+        # users page back and forth through the same cluster, so hang on to the expensive part
+        key = (docket_id, self.version, cluster_id, hierarchy.resolve(self.cutoff), document_id)
+        runs = frequency_cache.get(key)
+        if runs is None:
+            raw_phrases = self.corpus.phrase_overlap(document_id, cluster)
+            runs = max_coverage_runs(len(text), *phrase_intervals(raw_phrases))
+            frequency_cache.set(key, runs)
+        run_values, run_lengths = runs
         cluster_size = float(len(cluster))
 
         components = []
         cursor = 0
-        for fr in freq_ranges:
-            components.append((fr[0], text[cursor:cursor + fr[1]]))
-            cursor += fr[1]
+        for value, run_length in zip(run_values.tolist(), run_lengths.tolist()):
+            components.append((value, text[cursor:cursor + run_length]))
+            cursor += run_length
 
         html = ''.join(['<span style="background-color:rgba(160,211,216,%s)">%s</span>' % (round(p[0]/cluster_size, 2), p[1]) for p in components])
         html = html.replace("\n", "<br />")
@@ -239,18 +302,34 @@ class DocumentClusterView(CommonClusterView):
             'truncated': len(doc['text']) == 10000
         })
 
+class ClusterCutView(CommonClusterView):
+    """All the clusters at an arbitrary cutoff, cut from the stored hierarchy rather than reclustered."""
+    @profile
+    def get(self, request, docket_id):
+        hierarchy = self.hierarchy(request.GET.get('require_summaries', "").lower()=="true", with_members=False)
+        cutoff = hierarchy.resolve(self.cutoff)
+
+        return Response({
+            'requested_cutoff': self.cutoff,
+            'cutoff': cutoff,
+            'clusters': [{
+                'id': entry[1],
+                'size': entry[2]
+            } for entry in hierarchy.cut(cutoff)]
+        })
+
 class DocumentClusterChainView(CommonClusterView):
     @profile
     def get(self, request, docket_id, document_id):
         document_id = int(document_id)
 
-        h = self.corpus.hierarchy()
+        hierarchy = self.hierarchy(with_members=False)
 
         return Response({
             'clusters': [{
                 'cutoff': round(entry[0], 2),
                 'id': entry[1],
                 'size': entry[2]
-            } for entry in trace_doc_in_hierarchy(h, document_id)]
+            } for entry in hierarchy.trace(document_id)]
         })
 
@@ -0,0 +1,46 @@
+"""Running independent backend calls side by side.
+
+Calls run on a process-wide thread pool, created on first use in each process
+so gunicorn workers don't inherit a pool whose threads didn't survive the
+fork.  Under gevent workers the threads are patched into greenlets.
+"""
+from django.conf import settings
+
+from multiprocessing.pool import ThreadPool
+from multiprocessing import TimeoutError
+import os, threading, time
+
+FANOUT_POOL_SIZE = getattr(settings, 'FANOUT_POOL_SIZE', 10)
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPool(FANOUT_POOL_SIZE)
+            _pool_pid = os.getpid()
+    return _pool
+
+def fan_out(*calls):
+    """Run (func, args, timeout, default) calls concurrently and return their results in order.
+
+    Each timeout counts from when the calls are started, so the whole thing
+    takes as long as the slowest call, or its timeout.  A call that times out
+    gives its default instead (it's left to finish in the background); one
+    that raises raises here.
+    """
+    pool = get_pool()
+    started = time.time()
+    pending = [(pool.apply_async(func, args), timeout, default) for func, args, timeout, default in calls]
+
+    results = []
+    for result, timeout, default in pending:
+        try:
+            results.append(result.get(max(started + timeout - time.time(), 0)))
+        except TimeoutError:
+            results.append(default)
+    return results
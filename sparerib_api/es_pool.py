@@ -0,0 +1,78 @@
+"""A process-wide pool of Elasticsearch clients.
+
+Each pyes client keeps its own keep-alive HTTP connections, but isn't safe to
+share between concurrent requests, so rather than building a client (and new
+connections) per search, requests check one out of the pool and give it back
+when they're done.  Clients are created lazily, so nothing is opened before a
+gunicorn worker forks, and the pool is a plain Queue, so it cooperates with
+gevent workers once the standard library is monkey-patched.
+
+The pool only bounds how many idle clients are kept around (ES_POOL_SIZE);
+concurrency is already bounded by the number of worker threads, so a request
+that finds the pool empty just gets a fresh client.
+"""
+from django.conf import settings
+
+from contextlib import contextmanager
+import Queue, json
+
+import pyes
+
+ES_POOL_SIZE = getattr(settings, 'ES_POOL_SIZE', 10)
+ES_TIMEOUT = getattr(settings, 'ES_TIMEOUT', 10.0)
+ES_MAX_RETRIES = getattr(settings, 'ES_MAX_RETRIES', 3)
+
+class ESPool(object):
+    def __init__(self, size=ES_POOL_SIZE, timeout=ES_TIMEOUT, max_retries=ES_MAX_RETRIES):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._idle = Queue.LifoQueue(size)
+
+    def get(self):
+        try:
+            # most recently used first, since its connections are the most likely to still be open
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            return pyes.ES(settings.ES_SETTINGS, timeout=self.timeout, max_retries=self.max_retries)
+
+    def put(self, client):
+        try:
+            self._idle.put_nowait(client)
+        except Queue.Full:
+            pass
+
+    @contextmanager
+    def client(self):
+        """Check out a client for the duration of the block.
+
+        Clients whose block raised are dropped rather than returned, in case
+        their connections are what failed.
+        """
+        client = self.get()
+        yield client
+        self.put(client)
+
+pool = ESPool()
+
+def search_raw(query, **kwargs):
+    """ES.search_raw on a pooled client."""
+    with pool.client() as es:
+        return es.search_raw(query, **kwargs)
+
+def search_scroll(scroll_id, **kwargs):
+    """ES.search_scroll on a pooled client."""
+    with pool.client() as es:
+        return es.search_scroll(scroll_id, **kwargs)
+
+def clear_scroll(scroll_id):
+    """Free a scroll's search context now rather than when it times out."""
+    with pool.client() as es:
+        # pyes has no clear-scroll call either
+        return es._send_request('DELETE', '_search/scroll', scroll_id)
+
+def msearch(searches):
+    """Run several (query, indices, doc_types) searches in one _msearch round trip, returning their raw responses in order."""
+    body = ''.join("%s\n%s\n" % (json.dumps({'index': indices, 'type': doc_types}), json.dumps(query)) for query, indices, doc_types in searches)
+    with pool.client() as es:
+        # pyes has no public multi-search call, but its request plumbing handles the rest
+        return es._send_request('GET', '_msearch', body)['responses']
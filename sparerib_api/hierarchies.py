@@ -0,0 +1,344 @@
+"""Materialized cluster hierarchies.
+
+Building a hierarchy out of the analysis corpus is by far the most expensive
+part of the clustering endpoints, so each one is built once per corpus version
+and kept in Mongo alongside the rest of the docket data.  Records are keyed by
+docket and require_summaries, and are rebuilt whenever the corpus they came
+from changes.
+"""
+from django.conf import settings
+from django.db import connection
+
+from bson.binary import Binary
+from regs_models import Doc
+from util import uniq
+from cache import LRUCache
+
+import bisect, datetime, threading, time, zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import numpypy
+except:
+    pass
+import numpy
+
+HIERARCHY_COLLECTION = getattr(settings, 'HIERARCHY_COLLECTION', 'cluster_hierarchies')
+
+# bump whenever the stored layout changes so old records get rebuilt instead of misread
+STORE_FORMAT = 5
+
+# fully loaded hierarchies, bounded by the total number of clusters and members they hold
+_loaded = LRUCache(getattr(settings, 'HIERARCHY_CACHE_SIZE', 5000000), weigh=lambda hierarchy: len(hierarchy.parent) + len(hierarchy.members))
+
+# requests per stored hierarchy since they were last written to Mongo, as (hits, last requested) by key
+_hits = {}
+_hits_lock = threading.Lock()
+_hits_flushed = time.time()
+HITS_FLUSH_INTERVAL = getattr(settings, 'HIERARCHY_HITS_FLUSH_INTERVAL', 60)
+
+# cluster keys that the compact layout has its own arrays for; anything else rides along in `extras`
+NODE_KEYS = set(['name', 'cutoff', 'size', 'members', 'children'])
+
+
+class ClusterHierarchy(object):
+    """A cluster hierarchy stored as flat arrays rather than nested dicts.
+
+    Clusters are numbered in preorder, so a parent always comes before its
+    children.  `parent`, `cutoff`, `name` and `size` are per-cluster arrays
+    (roots have a parent of -1).  All member IDs live in one shared `members`
+    array, laid out so that every cluster's members are the contiguous slice
+    member_start[i]:member_end[i]; each document ID is stored once rather than
+    once per level.  `docs` is the sorted list of clustered document IDs and
+    `doc_leaf` the deepest cluster holding each, so finding a document's
+    clusters is a binary search plus a walk up `parent`.
+
+    The summary holds `counts`, mapping each cutoff to the number of clusters
+    at that level, `clustered`, the number of documents in any cluster, and
+    `prepopulate`, the document and cluster the docket page opens with by
+    default.
+
+    The hierarchy doubles as a dendrogram: clusters only exist at a handful of
+    cutoff levels, and any other cutoff is answered by the nearest level at or
+    below it (see resolve()), so arbitrary cutoffs never need a recluster.
+
+    The summary, index (everything but members and extras) and members are
+    stored separately.  The summary is always loaded; a hierarchy loaded
+    without its members can answer locate(), trace() and cut() but not find()
+    or serialize(), and one loaded without its index only has the summary.
+    """
+    def __init__(self, tree=None, index=None, members=None, summary=None):
+        if tree is not None:
+            self._build(tree)
+            return
+
+        if index is not None:
+            self.parent, self.cutoff, self.name, self.size, self.docs, self.doc_leaf = index
+        if members is not None:
+            self.member_start, self.member_end, self.members, self.extras = members
+
+        self.counts = summary['counts']
+        self.clustered = summary['clustered']
+        self.prepopulate = summary['prepopulate']
+        self.levels = sorted(self.counts)
+
+    def _build(self, tree):
+        parent, cutoff, name, size, member_start, member_end = [], [], [], [], [], []
+        members, leaves, extras = [], {}, {}
+
+        def visit(cluster, parent_index):
+            index = len(parent)
+            parent.append(parent_index)
+            cutoff.append(cluster['cutoff'])
+            name.append(cluster['name'])
+            size.append(cluster['size'])
+            member_start.append(len(members))
+            member_end.append(None)
+
+            extra = dict((key, value) for key, value in cluster.items() if key not in NODE_KEYS)
+            if extra:
+                extras[index] = extra
+
+            # children lay their members down first, then this cluster adds the rest right after
+            for child in cluster['children']:
+                visit(child, index)
+            in_children = set(members[member_start[index]:])
+            for doc_id in cluster['members']:
+                if doc_id not in in_children:
+                    members.append(doc_id)
+                    leaves[doc_id] = index
+            member_end[index] = len(members)
+
+        for cluster in tree:
+            visit(cluster, -1)
+
+        self.parent = numpy.array(parent, 'l')
+        self.cutoff = numpy.array(cutoff, 'd')
+        self.name = numpy.array(name, 'l')
+        self.size = numpy.array(size, 'l')
+        self.member_start = numpy.array(member_start, 'l')
+        self.member_end = numpy.array(member_end, 'l')
+        self.members = numpy.array(members, 'l')
+        self.extras = extras
+
+        docs = sorted(leaves)
+        self.docs = numpy.array(docs, 'l')
+        self.doc_leaf = numpy.array([leaves[doc_id] for doc_id in docs], 'l')
+
+        self.counts = {}
+        for level in cutoff:
+            self.counts[level] = self.counts.get(level, 0) + 1
+        self.levels = sorted(self.counts)
+
+        self.clustered = sum(cluster['size'] for cluster in tree)
+        top = max(tree, key=lambda cluster: cluster['size']) if tree else None
+        self.prepopulate = {
+            'document': top['members'][0],
+            'cluster': top['name'],
+            'cutoff': top['cutoff']
+        } if top else None
+
+    @property
+    def index(self):
+        return (self.parent, self.cutoff, self.name, self.size, self.docs, self.doc_leaf)
+
+    @property
+    def membership(self):
+        return (self.member_start, self.member_end, self.members, self.extras)
+
+    def _entry(self, cluster):
+        return (float(self.cutoff[cluster]), int(self.name[cluster]), int(self.size[cluster]))
+
+    def _chain(self, doc_id):
+        """Indexes of the clusters containing doc_id, deepest first."""
+        position = numpy.searchsorted(self.docs, doc_id)
+        if position == len(self.docs) or self.docs[position] != doc_id:
+            return []
+
+        chain = []
+        cluster = int(self.doc_leaf[position])
+        while cluster >= 0:
+            chain.append(cluster)
+            cluster = int(self.parent[cluster])
+        return chain
+
+    def _locate(self, doc_id, cutoff):
+        level = self.resolve(cutoff)
+        if level is None:
+            return None
+        for cluster in self._chain(doc_id):
+            if self.cutoff[cluster] == level:
+                return cluster
+        return None
+
+    def resolve(self, cutoff):
+        """The cutoff level that answers for an arbitrary cutoff.
+
+        A cluster found at one level stands for every cutoff up to the next
+        level, so other values snap down to the nearest level below them.
+        Cutoffs below every level have no clusters, and resolve to None.
+        """
+        if not self.levels:
+            return cutoff
+        # allow for float noise from clients, so 0.7999999 still means 0.8
+        position = bisect.bisect_right(self.levels, cutoff + 1e-6)
+        return self.levels[position - 1] if position else None
+
+    def count(self, cutoff):
+        """The number of clusters at the given cutoff."""
+        return self.counts.get(self.resolve(cutoff), 0)
+
+    def cut(self, cutoff):
+        """(cutoff, name, size) for every cluster at the given cutoff, biggest first."""
+        level = self.resolve(cutoff)
+        if level is None:
+            return []
+        clusters = numpy.flatnonzero(self.cutoff == level)
+        return sorted([self._entry(cluster) for cluster in clusters], key=lambda entry: entry[2], reverse=True)
+
+    def locate(self, doc_id, cutoff):
+        """(cutoff, name, size) of the cluster at the given cutoff that contains doc_id, or None."""
+        cluster = self._locate(doc_id, cutoff)
+        return self._entry(cluster) if cluster is not None else None
+
+    def find(self, doc_id, cutoff):
+        """The cluster at the given cutoff that contains doc_id, as a dict with its members, or None."""
+        cluster = self._locate(doc_id, cutoff)
+        if cluster is None:
+            return None
+
+        entry = self._entry(cluster)
+        return {
+            'cutoff': entry[0],
+            'name': entry[1],
+            'size': entry[2],
+            'members': self.members[self.member_start[cluster]:self.member_end[cluster]].tolist()
+        }
+
+    def trace(self, doc_id):
+        """(cutoff, name, size) for every cluster containing doc_id, from the top level down."""
+        return [self._entry(cluster) for cluster in reversed(self._chain(doc_id))]
+
+    def serialize(self):
+        """The nested cluster list the API returns, without member IDs."""
+        roots, nodes = [], []
+        for cluster, (parent, cutoff, name, size) in enumerate(zip(self.parent.tolist(), self.cutoff.tolist(), self.name.tolist(), self.size.tolist())):
+            node = {'name': name, 'cutoff': cutoff, 'size': size, 'children': []}
+            node.update(self.extras.get(cluster, {}))
+            nodes.append(node)
+            (roots if parent < 0 else nodes[parent]['children']).append(node)
+        return roots
+
+
+def _collection():
+    return Doc._get_db()[HIERARCHY_COLLECTION]
+
+def _key(docket_id, require_summaries):
+    return "%s:%s" % (docket_id, 'summaries' if require_summaries else 'plain')
+
+def _pack(obj):
+    return Binary(zlib.compress(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)))
+
+def _unpack(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+def corpus_version(corpus):
+    """Cheap fingerprint of a corpus that changes whenever documents are added to or removed from it."""
+    cursor = connection.cursor()
+    cursor.execute("SELECT count(*), coalesce(max(document_id), -1) FROM documents WHERE corpus_id = %s", [corpus.id])
+    count, max_id = cursor.fetchone()
+    return "%s-%s-%s" % (corpus.id, count, max_id)
+
+def is_current(docket_id, version, require_summaries=False):
+    return _collection().find_one({'_id': _key(docket_id, require_summaries), 'version': version, 'format': STORE_FORMAT}, ['_id']) is not None
+
+def build_hierarchy(docket_id, corpus, require_summaries=False, version=None):
+    """Compute a docket's hierarchy from its corpus and store it, replacing any older version."""
+    if version is None:
+        version = corpus_version(corpus)
+
+    hierarchy = ClusterHierarchy(corpus.hierarchy(require_summaries))
+    _loaded.set((docket_id, require_summaries, version), hierarchy)
+
+    # update rather than replace, so request statistics survive rebuilds
+    _collection().update({'_id': _key(docket_id, require_summaries)}, {'$set': {
+        'docket_id': docket_id,
+        'require_summaries': require_summaries,
+        'version': version,
+        'format': STORE_FORMAT,
+        'built': datetime.datetime.now(),
+        # Mongo keys can't contain dots, so cutoffs are stored as pairs
+        'counts': sorted(hierarchy.counts.items()),
+        'clustered': hierarchy.clustered,
+        'prepopulate': hierarchy.prepopulate,
+        'index': _pack(hierarchy.index),
+        'members': _pack(hierarchy.membership)
+    }}, upsert=True)
+
+    return hierarchy
+
+def loaded_hierarchy(docket_id, require_summaries, version):
+    """The fully loaded hierarchy for a docket and corpus version if it's in memory, or None; never touches Mongo or the corpus."""
+    return _loaded.get((docket_id, require_summaries, version))
+
+def record_request(docket_id, require_summaries=False):
+    """Count a request for a docket's hierarchy, for the warm-up job's idea of what's popular.
+
+    Counts are kept in memory and written out at most every
+    HITS_FLUSH_INTERVAL seconds, so serving a hierarchy from memory doesn't
+    cost a Mongo write.
+    """
+    global _hits, _hits_flushed
+
+    key = _key(docket_id, require_summaries)
+    now = datetime.datetime.now()
+    with _hits_lock:
+        _hits[key] = (_hits[key][0] + 1 if key in _hits else 1, now)
+        if time.time() - _hits_flushed < HITS_FLUSH_INTERVAL:
+            return
+        pending, _hits, _hits_flushed = _hits, {}, time.time()
+
+    collection = _collection()
+    for key, (hits, requested) in pending.iteritems():
+        # fire-and-forget
+        collection.update({'_id': key}, {'$inc': {'hits': hits}, '$set': {'requested': requested}}, w=0)
+
+def get_hierarchy(docket_id, corpus, require_summaries=False, version=None, with_index=True, with_members=True):
+    """Fetch a docket's ClusterHierarchy, building it first if the stored one is missing or stale.
+
+    Fully loaded hierarchies are also kept in memory, so repeated requests
+    against the same docket (say, from a similarity slider) skip Mongo
+    entirely.  Otherwise, leaving out the members and index skips reading them
+    at all, which is what lets the teasers stay cheap.  Hierarchies may be
+    shared between requests, so treat them as read-only.
+    """
+    if version is None:
+        version = corpus_version(corpus)
+
+    key = _key(docket_id, require_summaries)
+
+    hierarchy = loaded_hierarchy(docket_id, require_summaries, version)
+    if hierarchy:
+        return hierarchy
+
+    fields = ['counts', 'clustered', 'prepopulate'] + (['index'] if with_index else []) + (['members'] if with_members else [])
+    record = _collection().find_one({'_id': key, 'version': version, 'format': STORE_FORMAT}, fields)
+    if record:
+        record['counts'] = dict(record['counts'])
+        hierarchy = ClusterHierarchy(
+            index=_unpack(record['index']) if with_index else None,
+            members=_unpack(record['members']) if with_members else None,
+            summary=record
+        )
+        if with_index and with_members:
+            _loaded.set((docket_id, require_summaries, version), hierarchy)
+        return hierarchy
+
+    return build_hierarchy(docket_id, corpus, require_summaries, version)
+
+def popular_dockets(since, limit):
+    """IDs of the dockets whose hierarchies were requested most often, among those requested since the given time."""
+    records = _collection().find({'requested': {'$gte': since}}, ['docket_id']).sort('hits', -1).limit(limit)
+    return uniq([record['docket_id'] for record in records])
@@ -0,0 +1,59 @@
+"""Batched interval arithmetic for painting phrase frequencies onto document text."""
+try:
+    import numpypy
+except:
+    pass
+import numpy
+
+
+def phrase_intervals(raw_phrases):
+    """Flatten corpus.phrase_overlap() output into parallel start, end and count arrays."""
+    starts, ends, counts = [], [], []
+    for phrase in raw_phrases.values():
+        for occurrence in phrase['indexes']:
+            starts.append(occurrence.start)
+            ends.append(occurrence.end)
+            counts.append(phrase['count'])
+    return numpy.array(starts, 'l'), numpy.array(ends, 'l'), numpy.array(counts, 'l')
+
+def max_coverage_runs(length, starts, ends, values):
+    """Run-length encode the maximum value covering each position of [0, length).
+
+    Positions no interval covers get 0.  Instead of painting every occurrence
+    character by character, each interval is replaced by the two (overlapping)
+    power-of-two blocks that exactly cover it, written with numpy.maximum.at in
+    one batch per block size, and block maxima are then pushed down a level at
+    a time until every position holds its final value.  The cost is linear in
+    the number of intervals plus length * log2(longest interval), however much
+    the intervals overlap.  Returns parallel arrays of run values and run
+    lengths whose lengths sum to `length`.
+    """
+    if length <= 0:
+        return numpy.zeros(0, 'l'), numpy.zeros(0, 'l')
+
+    starts = numpy.clip(starts, 0, length)
+    ends = numpy.clip(ends, 0, length)
+    keep = ends > starts
+    starts, ends, values = starts[keep], ends[keep], values[keep]
+
+    # levels[i] is the largest k with 2**k <= the length of interval i
+    spans = ends - starts
+    levels = numpy.zeros(len(spans), 'l')
+    for k in xrange(1, int(spans.max()).bit_length() if len(spans) else 0):
+        levels[spans >= (1 << k)] = k
+
+    # current[i] holds the max of everything covering the block [i, i + 2**level)
+    current = numpy.zeros(length, 'l')
+    for level in xrange(int(levels.max()) if len(levels) else 0, -1, -1):
+        block = 1 << level
+        at_level = levels == level
+        numpy.maximum.at(current, starts[at_level], values[at_level])
+        numpy.maximum.at(current, ends[at_level] - block, values[at_level])
+
+        if level:
+            # a block covers its two half-size children, at i and i + block / 2
+            half = block >> 1
+            current[half:] = numpy.maximum(current[half:], current[:-half])
+
+    run_starts = numpy.concatenate(([0], numpy.flatnonzero(current[1:] != current[:-1]) + 1))
+    return current[run_starts], numpy.diff(numpy.concatenate((run_starts, [length])))
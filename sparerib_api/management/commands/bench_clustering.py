@@ -0,0 +1,123 @@
+from django.core.management.base import BaseCommand
+from django.test.client import RequestFactory
+from optparse import make_option
+
+from sparerib_api.benchmarks.synthetic import SyntheticCorpus, stand_in
+from sparerib_api.clustering import DocketHierarchyView, HierarchyTeaserView, SingleClusterView, DocumentClusterView
+from sparerib_api.hierarchies import get_hierarchy
+
+import multiprocessing, random, resource, time
+
+PERCENTILES = (50, 90, 99)
+
+def percentile(times, p):
+    ordered = sorted(times)
+    return ordered[int(round(p / 100.0 * (len(ordered) - 1)))]
+
+def bench_docket(size, options):
+    """Time every clustering endpoint against one synthetic docket; runs in its own process so peak memory is per docket."""
+    corpus = SyntheticCorpus(size, options['duplication'], options['form_size'], options['words'], seed=options['seed'])
+    rng = random.Random(options['seed'])
+    factory = RequestFactory()
+    docket_id = corpus.docket_id
+    cutoff = str(options['cutoff'])
+
+    def call(view, params, **kwargs):
+        request = factory.get('/', params)
+        request.apikey = 'bench'
+        response = view(request, **kwargs)
+        response.render()
+        if response.status_code != 200:
+            raise Exception("%s returned %s for %s" % (view.__name__, response.status_code, kwargs))
+
+    views = {
+        'hierarchy': DocketHierarchyView.as_view(),
+        'teaser': HierarchyTeaserView.as_view(),
+        'cluster': SingleClusterView.as_view(),
+        'document': DocumentClusterView.as_view()
+    }
+
+    with stand_in(corpus):
+        # the first request computes and stores the hierarchy; everything after is served from what it stored
+        start = time.time()
+        call(views['hierarchy'], {}, docket_id=docket_id)
+        build_time = time.time() - start
+
+        hierarchy = get_hierarchy(docket_id, corpus, version="%s-synthetic" % corpus.id)
+        clusters = [entry[1] for entry in hierarchy.cut(options['cutoff'])]
+        if not clusters:
+            raise Exception("No clusters at cutoff %s in a %d-document docket" % (options['cutoff'], size))
+
+        def document_teaser():
+            call(views['teaser'], {}, item_id="%s-%07d" % (docket_id, rng.choice(hierarchy.docs)), item_type='document')
+
+        def single_cluster(params={}):
+            params = dict(params, cutoff=cutoff)
+            call(views['cluster'], params, docket_id=docket_id, cluster_id=str(rng.choice(clusters)))
+
+        def document_cluster():
+            cluster_id = rng.choice(clusters)
+            document_id = rng.choice(hierarchy.find(cluster_id, options['cutoff'])['members'])
+            call(views['document'], {'cutoff': cutoff}, docket_id=docket_id, cluster_id=str(cluster_id), document_id=str(document_id))
+
+        cases = [
+            ('DocketHierarchyView', lambda: call(views['hierarchy'], {}, docket_id=docket_id)),
+            ('HierarchyTeaserView (docket)', lambda: call(views['teaser'], {}, item_id=docket_id, item_type='docket')),
+            ('HierarchyTeaserView (document)', document_teaser),
+            ('SingleClusterView', single_cluster),
+            ('SingleClusterView (paged)', lambda: single_cluster({'page': '1'})),
+            ('DocumentClusterView', document_cluster)
+        ]
+
+        timings = []
+        for name, func in cases:
+            times = []
+            for i in xrange(options['requests']):
+                start = time.time()
+                func()
+                times.append(time.time() - start)
+            timings.append((name, times))
+
+    return {
+        'size': size,
+        'clustered': hierarchy.clustered,
+        'clusters': len(clusters),
+        'build': build_time,
+        'timings': timings,
+        # kilobytes on Linux
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+def _bench_docket_star(args):
+    return bench_docket(*args)
+
+class Command(BaseCommand):
+    help = 'Time the clustering endpoints end to end against synthetic dockets, reporting latency percentiles and peak memory.'
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='1000,10000,100000', help='Comma-separated docket sizes, in documents.'),
+        make_option('--duplication', type='float', dest='duplication', default=0.5, help='Fraction of documents that are copies of form letters.'),
+        make_option('--form-size', type='int', dest='form_size', default=25, help='Average number of copies of each form letter.'),
+        make_option('--words', type='int', dest='words', default=300, help='Words per document.'),
+        make_option('--cutoff', type='float', dest='cutoff', default=0.8, help='Cutoff for cluster and document requests.'),
+        make_option('--requests', type='int', dest='requests', default=50, help='Timed requests per endpoint.'),
+        make_option('--seed', type='int', dest='seed', default=0),
+    )
+
+    def handle(self, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        for size in sizes:
+            # a fresh process per docket, so peak memory isn't carried over from the one before
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(_bench_docket_star, [(size, options)])
+            finally:
+                pool.close()
+                pool.join()
+
+            self.stdout.write("%d documents, %d clustered, %d clusters at %s\n" % (result['size'], result['clustered'], result['clusters'], options['cutoff']))
+            self.stdout.write("  %-32s %10.2f ms\n" % ('hierarchy build', result['build'] * 1000))
+            self.stdout.write("  %-32s %s %10s\n" % ('', ' '.join('%10s' % ('p%d' % p) for p in PERCENTILES), 'max'))
+            for name, times in result['timings']:
+                self.stdout.write("  %-32s %s %10.2f ms\n" % (name, ' '.join('%10.2f' % (percentile(times, p) * 1000) for p in PERCENTILES), max(times) * 1000))
+            self.stdout.write("  %-32s %10.1f MB\n\n" % ('peak RSS', result['rss'] / 1024.0))
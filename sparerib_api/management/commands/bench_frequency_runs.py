@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from sparerib_api.intervals import phrase_intervals, max_coverage_runs
+
+from collections import namedtuple
+import itertools, random, time
+
+import numpy
+
+Bounds = namedtuple('Bounds', ['start', 'end'])
+
+def synthetic_phrases(length, phrase_count, occurrences, max_phrase_length, max_count, seed):
+    """Random phrase_overlap()-shaped data for a document of the given length."""
+    rng = random.Random(seed)
+    phrases = {}
+    for phrase_id in xrange(phrase_count):
+        phrase_length = rng.randint(1, max_phrase_length)
+        indexes = []
+        for i in xrange(rng.randint(1, occurrences)):
+            start = rng.randint(0, max(0, length - phrase_length))
+            indexes.append(Bounds(start, start + phrase_length))
+        phrases[phrase_id] = {'count': rng.randint(1, max_count), 'indexes': indexes}
+    return phrases
+
+def loop_runs(length, raw_phrases):
+    """The original per-occurrence painting loop, kept for comparison."""
+    frequencies = numpy.zeros(length, 'l')
+    for phrase in raw_phrases.values():
+        for occurrence in phrase['indexes']:
+            frequencies[occurrence.start:occurrence.end] = numpy.maximum(frequencies[occurrence.start:occurrence.end], phrase['count'])
+    return [(f[0], len(list(f[1]))) for f in itertools.groupby(frequencies)]
+
+def vectorized_runs(length, raw_phrases):
+    run_values, run_lengths = max_coverage_runs(length, *phrase_intervals(raw_phrases))
+    return zip(run_values.tolist(), run_lengths.tolist())
+
+def best_time(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+class Command(BaseCommand):
+    help = 'Compare the vectorized phrase-frequency engine against the original painting loop.'
+    option_list = BaseCommand.option_list + (
+        make_option('--length', type='int', dest='length', default=10000, help='Document length in characters.'),
+        make_option('--phrases', type='int', dest='phrases', default=2000, help='Number of distinct phrases.'),
+        make_option('--occurrences', type='int', dest='occurrences', default=5, help='Maximum occurrences per phrase.'),
+        make_option('--phrase-length', type='int', dest='phrase_length', default=60, help='Maximum phrase length in characters.'),
+        make_option('--cluster-size', type='int', dest='cluster_size', default=500, help='Maximum phrase count.'),
+        make_option('--repeat', type='int', dest='repeat', default=5, help='Runs per implementation; the best is reported.'),
+        make_option('--seed', type='int', dest='seed', default=0),
+    )
+
+    def handle(self, **options):
+        length = options['length']
+        phrases = synthetic_phrases(length, options['phrases'], options['occurrences'], options['phrase_length'], options['cluster_size'], options['seed'])
+        occurrence_count = sum(len(phrase['indexes']) for phrase in phrases.values())
+
+        loop_time, loop_result = best_time(lambda: loop_runs(length, phrases), options['repeat'])
+        vector_time, vector_result = best_time(lambda: vectorized_runs(length, phrases), options['repeat'])
+
+        if [(int(v), int(l)) for v, l in loop_result] != list(vector_result):
+            self.stderr.write("Results differ!\n")
+
+        self.stdout.write("%d characters, %d phrases, %d occurrences, %d runs\n" % (length, len(phrases), occurrence_count, len(loop_result)))
+        self.stdout.write("loop:       %8.2f ms\n" % (loop_time * 1000))
+        self.stdout.write("vectorized: %8.2f ms\n" % (vector_time * 1000))
+        self.stdout.write("speedup:    %8.1fx\n" % (loop_time / vector_time if vector_time else float('inf')))
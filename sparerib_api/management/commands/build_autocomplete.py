@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from sparerib_api.autocomplete import PrefixIndex, load_items, save_index, AUTOCOMPLETE_INDEX_PATH
+
+import time
+
+class Command(BaseCommand):
+    help = 'Build the autocomplete index from Mongo and save it for the web processes to load.'
+    option_list = BaseCommand.option_list + (
+        make_option('--path', dest='path', default=AUTOCOMPLETE_INDEX_PATH,
+            help='Where to save the index; the web processes read AUTOCOMPLETE_INDEX_PATH.'),
+    )
+
+    def handle(self, **options):
+        started = time.time()
+        items = load_items()
+        index = PrefixIndex(items)
+        save_index(index, options['path'])
+
+        self.stdout.write("Indexed %d names under %d keys in %.1fs, saved to %s\n" % (len(items), len(index.keys), time.time() - started, options['path']))
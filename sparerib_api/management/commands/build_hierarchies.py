@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from analysis.corpus import get_dual_corpora_by_metadata
+from sparerib_api.hierarchies import build_hierarchy, corpus_version, is_current
+
+class Command(BaseCommand):
+    args = '<docket_id docket_id ...>'
+    help = 'Build and store cluster hierarchies for the given dockets ahead of time.'
+    option_list = BaseCommand.option_list + (
+        make_option('--summaries', action='store_true', dest='summaries', default=False,
+            help='Also build the hierarchy variant with phrase summaries.'),
+        make_option('--force', action='store_true', dest='force', default=False,
+            help='Rebuild even if the stored hierarchy is current.'),
+    )
+
+    def handle(self, *docket_ids, **options):
+        if not docket_ids:
+            raise CommandError('Specify at least one docket ID.')
+
+        variants = [False, True] if options['summaries'] else [False]
+
+        for docket_id in docket_ids:
+            corpus = get_dual_corpora_by_metadata('docket_id', docket_id)
+            if not corpus:
+                self.stderr.write("No analysis found for docket %s\n" % docket_id)
+                continue
+
+            version = corpus_version(corpus)
+            for require_summaries in variants:
+                if not options['force'] and is_current(docket_id, version, require_summaries):
+                    self.stdout.write("%s (summaries=%s) is current\n" % (docket_id, require_summaries))
+                    continue
+
+                build_hierarchy(docket_id, corpus, require_summaries, version)
+                self.stdout.write("Built %s (summaries=%s)\n" % (docket_id, require_summaries))
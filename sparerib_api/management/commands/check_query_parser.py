@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from sparerib_api.query_parse import parse_query, parse_query_for_mongo
+
+from pyparsing import Word, Optional, ZeroOrMore, QuotedString, Group, Literal, printables
+import pyparsing
+import random
+
+# pyparsing 3 also decodes numeric escapes (\0, \x41 and so on) in quoted labels; the site runs
+# pyparsing 2 under Python 2, so that's what the parser matches, and what comparisons are good for
+COMPARABLE = int(pyparsing.__version__.split('.')[0]) < 3
+
+def SearchSyntax():
+    """The pyparsing grammar query_parse used to use, unchanged."""
+    printables_without_colon = ''.join(letter for letter in printables if letter != ':')
+    Colon = Literal(":").suppress()
+
+    Filter = Group(Word(printables_without_colon) + Colon + Word(printables_without_colon) + Optional(Colon + (QuotedString('"', "\\") | Word(printables)))).setResultsName('filters')
+    Filter.modalResults = False
+
+    TextTerm = (QuotedString('"', "\\", unquoteResults=False) | Word(printables)).setResultsName('text_terms')
+    TextTerm.modalResults = False
+
+    Term = Filter | TextTerm
+    Query = ZeroOrMore(Term)
+    return Query
+
+_syntax = SearchSyntax()
+
+def legacy_parse_query(query):
+    parsed = _syntax.parseString(query)
+    return {'text': ' '.join(parsed.text_terms), 'filters': parsed.filters.asList() if parsed.filters else []}
+
+def legacy_parse_query_for_mongo(query):
+    parsed = _syntax.parseString(query)
+    quoted_terms = ['"%s"' % word.replace('"', '\\"') if not (word[0] == word[-1] and word[0] in ('"', "'")) else word for word in parsed.text_terms]
+    return {'text': ' '.join(parsed.text_terms), 'quoted_text': ' '.join(quoted_terms), 'filters': parsed.filters.asList() if parsed.filters else []}
+
+EXAMPLES = [
+    '',
+    'epa',
+    'clean water act',
+    '"clean water" act',
+    'agency:EPA',
+    'agency:EPA water',
+    'agency : EPA',
+    'agency: EPA',
+    'agency :EPA:"Environmental Protection Agency" water',
+    'submitter:abc123:"Some \\"Quoted\\" Org"',
+    'mentioned:abc123:Label extra',
+    'docket:EPA-HQ-OAR-2009-0234 type:public_submission',
+    'date:gte=2012-01-01',
+    'a:b:c:d',
+    'a::b',
+    ':a',
+    'a:',
+    'a:b:',
+    'a:b: ',
+    '"unterminated phrase',
+    '"escaped \\" quote"',
+    '"a:b"',
+    '"a":b',
+    "'single quoted'",
+    '"',
+    'tab\tseparated\nterms',
+    'a:b:"escaped\\twhitespace\\n"',
+    'a:b:"escaped\\\\tbackslash"',
+    'a:b:"other \\escapes\\x41\\0"',
+]
+
+# characters that exercise every branch of the grammar, weighted towards the interesting ones
+ALPHABET = 'abcXYZ019tnfr-_=.' + ':::' + '""' + '\\\\' + "'" + '   \t\n'
+
+def random_query(rng, max_length):
+    return ''.join(rng.choice(ALPHABET) for i in xrange(rng.randint(0, max_length)))
+
+class Command(BaseCommand):
+    help = 'Compare the query parser against the pyparsing grammar it replaced, on fixed examples and random queries.'
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=100000, help='Number of random queries.'),
+        make_option('--length', type='int', dest='length', default=30, help='Maximum random query length.'),
+        make_option('--seed', type='int', dest='seed', default=0),
+    )
+
+    def handle(self, **options):
+        if not COMPARABLE:
+            self.stderr.write("Warning: pyparsing %s decodes escapes the deployed pyparsing 2 didn't, so expect mismatches in quoted labels\n" % pyparsing.__version__)
+
+        rng = random.Random(options['seed'])
+        queries = EXAMPLES + [random_query(rng, options['length']) for i in xrange(options['count'])]
+
+        mismatches = 0
+        for query in queries:
+            for new, old in ((parse_query, legacy_parse_query), (parse_query_for_mongo, legacy_parse_query_for_mongo)):
+                if new(query) != old(query):
+                    mismatches += 1
+                    self.stdout.write("%s(%r):\n  new: %r\n  old: %r\n" % (new.__name__, query, new(query), old(query)))
+
+        self.stdout.write("%d queries, %d mismatches\n" % (len(queries), mismatches))
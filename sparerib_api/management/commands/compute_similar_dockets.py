@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from sparerib_api.search import get_similar_dockets
+from sparerib_api.similar import docket_summary_text, store_similar_dockets, SIMILAR_DOCKETS_COLLECTION
+from regs_models import Doc, Docket
+
+import datetime
+
+class Command(BaseCommand):
+    args = '<docket_id docket_id ...>'
+    help = 'Precompute similar-docket recommendations for the given dockets, or all dockets with Federal Register documents.'
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=10,
+            help='How many similar dockets to store for each docket.'),
+        make_option('--max-age', type='int', dest='max_age', default=None,
+            help='Only recompute dockets whose recommendations are older than this many days, or missing.'),
+    )
+
+    def handle(self, *docket_ids, **options):
+        if docket_ids:
+            dockets = Docket.objects(id__in=docket_ids)
+        else:
+            dockets = Docket.objects(__raw__={'stats.doc_info.fr_docs.0': {'$exists': True}})
+
+        fresh = set()
+        if options['max_age'] is not None:
+            since = datetime.datetime.now() - datetime.timedelta(days=options['max_age'])
+            fresh = set(record['_id'] for record in Doc._get_db()[SIMILAR_DOCKETS_COLLECTION].find({'computed': {'$gte': since}}, ['_id']))
+
+        computed = 0
+        for docket in dockets.only('id', 'stats').timeout(False):
+            if docket.id in fresh:
+                continue
+
+            text = docket_summary_text(docket) if docket.stats else ""
+            similar = get_similar_dockets(text, docket.id)[:options['count']] if text else []
+            store_similar_dockets(docket.id, similar)
+
+            computed += 1
+            self.stdout.write("%s: %s\n" % (docket.id, ", ".join(similar) if similar else "none"))
+
+        self.stdout.write("Computed recommendations for %d dockets\n" % computed)
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from optparse import make_option
+
+from analysis.corpus import get_dual_corpora_by_metadata
+from sparerib_api.hierarchies import build_hierarchy, corpus_version, is_current, popular_dockets
+from sparerib_api.util import uniq
+from regs_models import Docket
+
+import datetime, multiprocessing, time, traceback
+
+def warm_docket(docket_id, variants):
+    """Bring a docket's stored hierarchies up to date; runs in a pool worker."""
+    try:
+        corpus = get_dual_corpora_by_metadata('docket_id', docket_id)
+        if not corpus:
+            return "%s: no analysis" % docket_id
+
+        version = corpus_version(corpus)
+        built = []
+        for require_summaries in variants:
+            if not is_current(docket_id, version, require_summaries):
+                build_hierarchy(docket_id, corpus, require_summaries, version)
+                built.append('summaries' if require_summaries else 'plain')
+
+        return "%s: %s" % (docket_id, "built " + ", ".join(built) if built else "current")
+    except Exception:
+        return "%s: failed\n%s" % (docket_id, traceback.format_exc())
+    finally:
+        connection.close()
+
+def _warm_docket_star(args):
+    return warm_docket(*args)
+
+class Command(BaseCommand):
+    help = 'Precompute hierarchies, teaser counts and prepopulation data for recently updated and popular dockets.'
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=7,
+            help='Consider dockets updated or requested within this many days.'),
+        make_option('--popular', type='int', dest='popular', default=100,
+            help='How many of the most-requested dockets to keep warm.'),
+        make_option('--processes', type='int', dest='processes', default=multiprocessing.cpu_count(),
+            help='Number of worker processes.'),
+        make_option('--summaries', action='store_true', dest='summaries', default=False,
+            help='Also build the hierarchy variant with phrase summaries.'),
+        make_option('--worker', action='store_true', dest='worker', default=False,
+            help='Keep running, warming dockets every --interval seconds.'),
+        make_option('--interval', type='int', dest='interval', default=600,
+            help='Seconds between passes in worker mode.'),
+    )
+
+    def handle(self, *docket_ids, **options):
+        while True:
+            self.warm(docket_ids or self.candidates(options['days'], options['popular']), options)
+
+            if not options['worker']:
+                break
+            time.sleep(options['interval'])
+
+    def candidates(self, days, popular):
+        since = datetime.datetime.now() - datetime.timedelta(days=days)
+
+        recent = [docket.id for docket in Docket.objects(__raw__={'stats.date_range.1': {'$gte': since}}).only('id')]
+        return uniq(recent + popular_dockets(since, popular))
+
+    def warm(self, docket_ids, options):
+        variants = [False, True] if options['summaries'] else [False]
+
+        # forked workers mustn't share the parent's database connection
+        connection.close()
+
+        pool = multiprocessing.Pool(options['processes'])
+        try:
+            for result in pool.imap_unordered(_warm_docket_star, [(docket_id, variants) for docket_id in docket_ids]):
+                self.stdout.write(result + "\n")
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,71 @@
+"""PostgreSQL support for the analysis database.
+
+The clustering code needs hstore and the int_bounds composite type registered
+on every psycopg2 connection to the analysis database (ANALYSIS_DATABASE, the
+default alias unless set).  Registration normally runs catalog queries each
+time; here they only run for the first connection to that database in the
+process, and later connections reuse the type OIDs and casters found then.
+Registration is hooked to connection_created, so it happens once per physical
+connection; pair this
+with the pooled backend in sparerib_api.postgres.base to keep those connections
+around between requests.
+"""
+from django.db.backends.signals import connection_created
+from django.conf import settings
+
+import psycopg2.extras, psycopg2.extensions
+import threading, weakref
+
+ANALYSIS_DATABASE = getattr(settings, 'ANALYSIS_DATABASE', 'default')
+
+_lock = threading.Lock()
+# (hstore OIDs, int_bounds caster) by database alias, since OIDs differ between databases
+_types = {}
+_registered = weakref.WeakKeyDictionary()
+
+def _hstore_oids(conn):
+    was_idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT 'hstore'::regtype::oid, 'hstore[]'::regtype::oid")
+    oids = cursor.fetchone()
+    cursor.close()
+
+    # don't leave behind a transaction that wasn't open before
+    if was_idle:
+        conn.rollback()
+    return oids
+
+def register_types(conn, alias=ANALYSIS_DATABASE):
+    """Register hstore and int_bounds on a raw psycopg2 connection to the database `alias` names."""
+    with _lock:
+        if alias not in _types:
+            # register_composite looks the type up and registers it on this connection; the caster it
+            # returns can be registered on later connections without looking it up again
+            _types[alias] = (_hstore_oids(conn), psycopg2.extras.register_composite('int_bounds', conn))
+        hstore_oids, int_bounds = _types[alias]
+
+    oid, array_oid = hstore_oids
+    psycopg2.extras.register_hstore(conn, oid=oid, array_oid=array_oid)
+
+    psycopg2.extensions.register_type(int_bounds.typecaster, conn)
+    if int_bounds.array_typecaster is not None:
+        psycopg2.extensions.register_type(int_bounds.array_typecaster, conn)
+
+    _registered[conn] = True
+
+def register_on_connect(sender, connection, **kwargs):
+    if connection.vendor == 'postgresql' and connection.alias == ANALYSIS_DATABASE:
+        register_types(connection.connection, connection.alias)
+
+def ensure_registered(connection):
+    """Open a Django connection if needed and make sure its types are registered.
+
+    This only does any work for connections opened before this module was
+    imported, which connection_created never told us about.
+    """
+    connection.cursor()
+    if connection.connection not in _registered:
+        register_types(connection.connection, connection.alias)
+
+connection_created.connect(register_on_connect)
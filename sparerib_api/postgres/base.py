@@ -0,0 +1,95 @@
+"""A PostgreSQL backend that keeps physical connections open between requests.
+
+Django 1.5 connects at the start of every request and disconnects when it
+finishes.  With this backend, closing a connection hands it back to a
+process-wide pool of idle connections instead, and the next request that needs
+one takes it from there, skipping both the connection setup and the per-
+connection work done on connection_created.  The project settings switch the
+analysis database (ANALYSIS_DATABASE) over to it when it's configured with the
+stock postgresql_psycopg2 engine, unless POOL_DB_CONNECTIONS is False;
+POOL_SIZE in the same DATABASES entry caps how many idle connections are kept
+(10 by default).
+"""
+from django.db.backends.postgresql_psycopg2.base import *
+from django.db.backends.postgresql_psycopg2.base import DatabaseWrapper as PostgresDatabaseWrapper
+
+import psycopg2.extensions
+import os, threading
+
+DEFAULT_POOL_SIZE = 10
+
+class ConnectionPool(object):
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._pid = os.getpid()
+        # idle connections inherited from the process this one forked from
+        self._inherited = []
+        self._lock = threading.Lock()
+
+    def _check_pid(self):
+        # connections opened before a fork belong to the parent, so stop handing them out;
+        # closing them (even by letting them be garbage collected, which closes them too)
+        # would end the parent's session, so they're kept around, unused
+        if self._pid != os.getpid():
+            self._inherited.extend(self._idle)
+            self._idle = []
+            self._pid = os.getpid()
+
+    def get(self):
+        with self._lock:
+            self._check_pid()
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+        return None
+
+    def put(self, conn):
+        # only hang on to connections that are healthy and outside any transaction
+        try:
+            conn.rollback()
+            reusable = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        except psycopg2.Error:
+            reusable = False
+
+        if reusable:
+            with self._lock:
+                self._check_pid()
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    return
+
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool_for(alias, size):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(size)
+        return _pools[alias]
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    @property
+    def pool(self):
+        return _pool_for(self.alias, self.settings_dict.get('POOL_SIZE', DEFAULT_POOL_SIZE))
+
+    def _cursor(self):
+        if self.connection is None:
+            # an idle connection was set up when it was first opened; a brand new one gets
+            # Django's usual setup (and connection_created) in the parent class
+            self.connection = self.pool.get()
+        return super(DatabaseWrapper, self)._cursor()
+
+    def close(self):
+        self.validate_thread_sharing()
+        if self.connection is None:
+            return
+
+        conn, self.connection = self.connection, None
+        self.pool.put(conn)
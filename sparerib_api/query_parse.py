@@ -1,28 +1,95 @@
-from pyparsing import Word, Optional, ZeroOrMore, Or, QuotedString, Group, Literal, printables, alphas
+"""Search query parsing.
 
-def SearchSyntax():
-    printables_without_colon = ''.join(letter for letter in printables if letter != ':')
-    Colon = Literal(":").suppress()
-    
-    Filter = Group(Word(printables_without_colon) + Colon + Word(printables_without_colon) + Optional(Colon + (QuotedString('"', "\\") | Word(printables)))).setResultsName('filters')
-    Filter.modalResults = False
-    
-    TextTerm = (QuotedString('"', "\\", unquoteResults=False) | Word(printables)).setResultsName('text_terms')
-    TextTerm.modalResults = False
+Queries are whitespace-separated terms.  A term like `type:value` or
+`type:value:label` (whitespace is allowed around the colons, and the label can
+be a double-quoted string with backslash escapes, where \\t, \\n, \\f and \\r
+stand for whitespace) is a filter; anything else is a text term, where
+double-quoted phrases keep their quotes.
 
-    Term = Filter | TextTerm
-    Query = ZeroOrMore(Term)
-    return Query
+This is a single-pass tokenizer that behaves like the pyparsing grammar it
+replaced, as run by pyparsing 2 (the grammar is kept in the check_query_parser
+command, and the tests compare against it), except that non-ASCII and control
+characters count as part of a term instead of silently ending the query.  Parses are memoized, since the same query usually gets
+parsed more than once per request and again on the next page.
+"""
+from cache import LRUCache
 
-_syntax = SearchSyntax()
+import re
+
+_space = re.compile(r'[ \t\n\r]*')
+_word = re.compile(r'[^ \t\n\r]+')
+_filter_word = re.compile(r'[^ \t\n\r:]+')
+_quoted = re.compile(r'"(?:\\.|[^"\n\r\\])*"')
+_escape = re.compile(r'\\(.)')
+# pyparsing turned these into the real thing in quoted labels before dropping any other backslashes
+_whitespace_escapes = [('\\t', '\t'), ('\\n', '\n'), ('\\f', '\f'), ('\\r', '\r')]
+
+_parsed = LRUCache(10000)
+
+def _unescape(label):
+    for escaped, char in _whitespace_escapes:
+        label = label.replace(escaped, char)
+    return _escape.sub(r'\1', label)
+
+def _parse_filter(query, pos):
+    """The filter starting at pos and where it ends, or (None, pos) if there isn't one."""
+    match = _filter_word.match(query, pos)
+    if not match:
+        return None, pos
+    filter_type = match.group()
+
+    colon = _space.match(query, match.end()).end()
+    if not query.startswith(':', colon):
+        return None, pos
+    match = _filter_word.match(query, _space.match(query, colon + 1).end())
+    if not match:
+        return None, pos
+    value, end = match.group(), match.end()
+
+    # the label's optional, and if it isn't there, whatever follows is left for the next term
+    colon = _space.match(query, end).end()
+    if query.startswith(':', colon):
+        label_start = _space.match(query, colon + 1).end()
+        match = _quoted.match(query, label_start)
+        if match:
+            return [filter_type, value, _unescape(match.group()[1:-1])], match.end()
+        match = _word.match(query, label_start)
+        if match:
+            return [filter_type, value, match.group()], match.end()
+
+    return [filter_type, value], end
+
+def _parse(query):
+    parsed = _parsed.get(query)
+    if parsed is not None:
+        return parsed
+
+    # pyparsing expanded tabs before parsing, which shows inside quoted phrases
+    expanded = query.expandtabs()
+
+    text_terms, filters = [], []
+    pos = _space.match(expanded).end()
+    while pos < len(expanded):
+        query_filter, end = _parse_filter(expanded, pos)
+        if query_filter:
+            filters.append(tuple(query_filter))
+        else:
+            match = _quoted.match(expanded, pos) or _word.match(expanded, pos)
+            text_terms.append(match.group())
+            end = match.end()
+        pos = _space.match(expanded, end).end()
+
+    # for mongo we quote everything to force AND logical behavior
+    quoted_terms = ['"%s"' % word.replace('"', '\\"') if not (word[0] == word[-1] and word[0] in ('"', "'")) else word for word in text_terms]
+
+    parsed = (' '.join(text_terms), ' '.join(quoted_terms), tuple(filters))
+    _parsed.set(query, parsed)
+    return parsed
 
 def parse_query(query):
-    parsed = _syntax.parseString(query)
-    return {'text': ' '.join(parsed.text_terms), 'filters': parsed.filters.asList() if parsed.filters else []}
+    text, quoted_text, filters = _parse(query)
+    return {'text': text, 'filters': [list(f) for f in filters]}
 
-# for mongo we quote everything to force AND logical behavior
 def parse_query_for_mongo(query):
-    parsed = _syntax.parseString(query)
-    # add quotes to things if they're not already quoted
-    quoted_terms = ['"%s"' % word.replace('"', '\\"') if not (word[0] == word[-1] and word[0] in ('"', "'")) else word for word in parsed.text_terms]
-    return {'text': ' '.join(parsed.text_terms), 'quoted_text': ' '.join(quoted_terms), 'filters': parsed.filters.asList() if parsed.filters else []}
\ No newline at end of file
+    text, quoted_text, filters = _parse(query)
+    return {'text': text, 'quoted_text': quoted_text, 'filters': [list(f) for f in filters]}
@@ -3,15 +3,19 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from django.views.generic import View
+from django.http import StreamingHttpResponse
 from django.core.urlresolvers import reverse
 from django.conf import settings
 
 from util import *
+from cache import LRUCache
 
-import math, json, operator, copy
+import math, json, copy, base64, csv, logging, hashlib
 import dateutil, dateutil.parser
 
-import pyes
+import es_pool
+from pyes.exceptions import ElasticSearchException
+from concurrency import fan_out
 from query_parse import parse_query, parse_query_for_mongo
 
 from collections import defaultdict
@@ -20,32 +24,143 @@ from regs_models import *
 
 ### Constants ###
 
+log = logging.getLogger(__name__)
+
 EASTERN = dateutil.tz.gettz("US/Eastern")
 UTC = dateutil.tz.tzutc()
 ES_INDEX = getattr(settings, 'ES_INDEX', 'regulations')
 
+# how long ES keeps a cursor's scroll open between pages; most first pages are never followed, so they get less
+SCROLL_TIMEOUT = getattr(settings, 'SEARCH_SCROLL_TIMEOUT', '5m')
+FIRST_SCROLL_TIMEOUT = getattr(settings, 'SEARCH_FIRST_SCROLL_TIMEOUT', '1m')
+
+# SearchResultsView.fetch_page output for recent searches, by SearchResultsView.page_cache_key
+search_cache = LRUCache(getattr(settings, 'SEARCH_CACHE_SIZE', 1000), ttl=getattr(settings, 'SEARCH_CACHE_TTL', 300))
+
+# ranked (id, score) lists from Mongo text searches, bounded by the total number of IDs held
+ranked_id_cache = LRUCache(getattr(settings, 'MONGO_SEARCH_CACHE_SIZE', 1000000), weigh=len, ttl=getattr(settings, 'SEARCH_CACHE_TTL', 300))
+
+# counts for filter-only Mongo searches, by collection and filter; stopping at COUNT_ESTIMATE_LIMIT matches, if set, makes them a lower bound
+count_cache = LRUCache(getattr(settings, 'MONGO_COUNT_CACHE_SIZE', 10000), ttl=getattr(settings, 'MONGO_COUNT_CACHE_TTL', 60))
+COUNT_ESTIMATE_LIMIT = getattr(settings, 'MONGO_COUNT_ESTIMATE_LIMIT', None)
+
+# highlight snippets ES returns per field, and their length in characters
+HIGHLIGHT_FRAGMENTS = getattr(settings, 'SEARCH_HIGHLIGHT_FRAGMENTS', 5)
+HIGHLIGHT_FRAGMENT_SIZE = getattr(settings, 'SEARCH_HIGHLIGHT_FRAGMENT_SIZE', 100)
+
+# how many hits an export reads from ES or Mongo at a time, and so the most it holds at once
+EXPORT_BATCH_SIZE = getattr(settings, 'SEARCH_EXPORT_BATCH_SIZE', 500)
+
+def encode_cursor(scroll_id, page_num, fingerprint):
+    return base64.urlsafe_b64encode(json.dumps([scroll_id, page_num, fingerprint]))
+
+def decode_cursor(cursor):
+    scroll_id, page_num, fingerprint = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    return scroll_id, int(page_num), fingerprint
+
+class EchoBuffer(object):
+    """ A file for csv.writer that hands each row back instead of keeping it """
+    def write(self, value):
+        return value
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = '; '.join(unicode(item) for item in value)
+    return unicode(value).encode('utf-8')
+
 ### Base search classes ###
 
 class SearchResultsView(APIView):
     aggregation_level = None
     allowed_filters = ['agency', 'docket', 'submitter', 'mentioned', 'type']
 
+    # set to serve next/previous links for a path other than the request's, as the batch view does
+    path = None
+
+    # the result fields exported as CSV columns; views without them don't support ?export=
+    export_fields = None
+
     def get(self, request, query):
         self.set_query(query)
 
-        page_num = int(self.request.GET.get('page', '1'))
+        if 'export' in request.GET:
+            return self.export_response(request.GET['export'])
 
-        limit = self.get_limit()
+        key = self.page_cache_key()
+        page = search_cache.get(key)
+        if page is None:
+            page = self.fetch_page(self.get_results())
+            search_cache.set(key, page)
+            cache_status = 'MISS'
+        else:
+            cache_status = 'HIT'
+
+        return Response(self.serialize_page(page), headers={'X-Cache': cache_status})
+
+    def page_bounds(self):
+        """ The requested page number, and the start and end of its slice of the results """
+        page_num = int(self.request.GET.get('page', '1'))
 
         start = (page_num - 1) * self.get_limit()
         end = start + self.get_limit()
 
-        all_results = self.get_results()
+        return page_num, start, end
+
+    def page_cache_key(self):
+        return self.cache_key(self.page_bounds()[0], self.get_limit())
+
+    def fetch_page(self, all_results):
+        """ The requested page's results, the total, whether the total is an estimate, and facet counts, if any """
+        page_num, start, end = self.page_bounds()
+
         results = list(all_results[start:end])
-        serialized_page_info = self.serialize_page_info(page_num, len(all_results))
+        return {
+            'results': results,
+            'total': len(all_results),
+            'total_is_estimate': getattr(all_results, 'count_is_estimate', False),
+            'facets': getattr(all_results, 'facets', None)
+        }
 
-        serialized_page_info['results'] = results
-        return Response(serialized_page_info)
+    def serialize_page(self, page):
+        serialized_page_info = self.serialize_page_info(self.page_bounds()[0], page['total'])
+        if page['total_is_estimate']:
+            serialized_page_info['total_is_estimate'] = True
+        if page['facets'] is not None:
+            serialized_page_info['facets'] = page['facets']
+
+        serialized_page_info['results'] = page['results']
+        return serialized_page_info
+
+    def export_response(self, export_format):
+        """ Stream every result as NDJSON or CSV, reading them EXPORT_BATCH_SIZE at a time rather than a page per request; if the backend can only return so many, X-Export-Truncated and X-Export-Limit say so """
+        if not self.export_fields:
+            return Response({'error': 'This search can\'t be exported.'}, status=status.HTTP_400_BAD_REQUEST)
+        if export_format not in ('ndjson', 'csv'):
+            return Response({'error': 'Export format must be ndjson or csv.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        all_results = self.get_results()
+        results = all_results.export(EXPORT_BATCH_SIZE)
+        if export_format == 'ndjson':
+            response = StreamingHttpResponse((json.dumps(result, default=str) + "\n" for result in results), content_type='application/x-ndjson')
+        else:
+            response = StreamingHttpResponse(self.export_csv_rows(results), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="%s-search.%s"' % (self.aggregation_level, export_format)
+
+        # headers go out before any results, so this has to be known up front
+        limit = all_results.export_limit()
+        if limit is not None:
+            response['X-Export-Truncated'] = 'true'
+            response['X-Export-Limit'] = str(limit)
+        return response
+
+    def export_csv_rows(self, results):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(['id', 'url'] + self.export_fields)
+        for result in results:
+            fields = result.get('fields', {})
+            yield writer.writerow([csv_value(result['_id']), csv_value(result['url'])] + [csv_value(fields.get(field, None)) for field in self.export_fields])
 
     def set_query(self, query):
         parsed = parse_query(query)
@@ -53,9 +168,13 @@ class SearchResultsView(APIView):
         self.text_query = parsed['text']
         self.filters = parsed['filters']
 
+    def cache_key(self, *extra):
+        """ Identifies a search's results however it was written: terms are whitespace-normalized by the parser, filters are unordered, and labels and other query string parameters don't count """
+        return (self.__class__.__name__, self.text_query, tuple(sorted(tuple(f[:2]) for f in self.filters))) + extra
+
     def url_with_page_number(self, page_number):
         """ Constructs a url used for getting the next/previous urls """
-        url = "%s?page=%d" % (self.request.path, page_number)
+        url = "%s?page=%d" % (self.path or self.request.path, page_number)
 
         limit = self.get_limit()
         if limit != self.limit:
@@ -101,6 +220,75 @@ class SearchResultsView(APIView):
             return self.limit
 
 class ESSearchResultsView(SearchResultsView):
+    # facet name -> ES facet, returned alongside the hits with ?facets=true
+    facet_definitions = {}
+
+    def get(self, request, query):
+        if 'cursor' not in request.GET or 'export' in request.GET:
+            return super(ESSearchResultsView, self).get(request, query)
+
+        # cursor mode: page through an ES scroll, so deep pages cost the same as the first
+        self.set_query(query)
+        limit = self.get_limit()
+        all_results = self.get_results()
+
+        scroll_id, page_num = None, 1
+        if request.GET['cursor']:
+            try:
+                scroll_id, page_num, fingerprint = decode_cursor(request.GET['cursor'])
+            except (TypeError, ValueError):
+                return Response({'error': 'Invalid cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+            # a scroll has its query and page size baked in, so its cursor is no good for any other
+            if fingerprint != self.cursor_fingerprint():
+                return Response({'error': 'Cursor belongs to a different search or limit; start again without one.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results, next_scroll_id = all_results.scroll(scroll_id, limit)
+        except ElasticSearchException:
+            return Response({'error': 'Cursor has expired; start again without one.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serialized_page_info = self.serialize_page_info(page_num, len(all_results))
+        if serialized_page_info['next']:
+            serialized_page_info['next'] = self.url_with_cursor(encode_cursor(next_scroll_id, page_num + 1, self.cursor_fingerprint()))
+        else:
+            all_results.clear_scroll(next_scroll_id)
+        # scrolls only go forward
+        serialized_page_info['previous'] = None
+        if all_results.facets is not None:
+            serialized_page_info['facets'] = all_results.facets
+
+        serialized_page_info['results'] = results
+        return Response(serialized_page_info)
+
+    def wants_facets(self):
+        return bool(self.facet_definitions) and self.request.GET.get('facets', '').lower() == 'true'
+
+    def page_cache_key(self):
+        return super(ESSearchResultsView, self).page_cache_key() + (self.wants_facets(),)
+
+    def add_facets(self, query):
+        """ Ask for facet counts in the same request as the hits, if they were wanted, limited by the same filters """
+        if not self.wants_facets():
+            return
+
+        query['facets'] = {}
+        for name, facet in self.facet_definitions.items():
+            facet = copy.deepcopy(facet)
+            if 'filter' in query:
+                facet['facet_filter'] = query['filter']
+            query['facets'][name] = facet
+
+    def cursor_fingerprint(self):
+        """ Identifies the search and page size a cursor was made for """
+        return hashlib.sha1(repr(self.cache_key(self.get_limit()))).hexdigest()[:16]
+
+    def url_with_cursor(self, cursor):
+        # keep the rest of the query string (limit, facets and so on) as it was
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        params['cursor'] = cursor
+        return "%s?%s" % (self.path or self.request.path, params.urlencode())
+
     def get_es_filters(self, extra_terms={}):
         terms = defaultdict(list)
         terms.update(extra_terms)
@@ -180,7 +368,6 @@ class ESSearchResultsView(SearchResultsView):
 class ESSearchResults(object):
     indices = ES_INDEX
     doc_types = None
-    _es = None
 
     def __init__(self, query):
         self.query = query
@@ -188,21 +375,81 @@ class ESSearchResults(object):
         # paginator wants the count before we know what slice we want, so add some indirection hackery to avoid having to do two queries
         self._count = -1
 
-    @property
-    def es(self):
-        if not self._es:
-            self._es = es = pyes.ES(settings.ES_SETTINGS)
-        return self._es
-
     def __getslice__(self, start, end):
         if not self._results:
-            self.query['from'] = start
-            self.query['size'] = end - start
-            
-            self._results = self.es.search_raw(self.query, indices=self.indices, doc_types=self.doc_types)
-            self._count = self._results['hits']['total']
+            query, indices, doc_types = self.search_request(start, end)
+            self.set_results(es_pool.search_raw(query, indices=indices, doc_types=doc_types))
+
+        return self.stitch(self._results['hits']['hits'])
+
+    def search_request(self, start, end):
+        """ The (query, indices, doc_types) for a slice of these results, so it can be batched with others """
+        self.query['from'] = start
+        self.query['size'] = end - start
+
+        return self.query, self.indices, self.doc_types
+
+    def set_results(self, results):
+        """ Supply the raw ES response for search_request's slice, after which slicing doesn't search again """
+        self._results = results
+        self._count = results['hits']['total']
+
+    def scroll(self, scroll_id=None, size=None):
+        """ Returns a page of results and the scroll ID of the page after it; starts a new scroll of `size`-hit pages if no scroll ID is given """
+        if scroll_id is None:
+            self.query['size'] = size
+            self._results = es_pool.search_raw(self.query, indices=self.indices, doc_types=self.doc_types, scroll=FIRST_SCROLL_TIMEOUT)
+        else:
+            self._results = es_pool.search_scroll(scroll_id, scroll=SCROLL_TIMEOUT)
+        self._count = self._results['hits']['total']
+
+        return self.stitch(self._results['hits']['hits']), self._results['_scroll_id']
+
+    def export_limit(self):
+        """ The most results export() will give if that's fewer than match, or None if it gives them all """
+        return None
 
-        return self._results['hits']['hits']
+    def export(self, batch_size):
+        """ Every hit, best first, from a scroll of batch_size-hit pages """
+        self.query.pop('facets', None)
+
+        hits, scroll_id = self.scroll(None, batch_size)
+        try:
+            while hits:
+                for hit in hits:
+                    yield hit
+                hits, scroll_id = self.scroll(scroll_id)
+        finally:
+            # also runs if the client goes away partway through
+            self.clear_scroll(scroll_id)
+
+    def clear_scroll(self, scroll_id):
+        try:
+            es_pool.clear_scroll(scroll_id)
+        except Exception:
+            # it'll time out on its own anyway
+            pass
+
+    def stitch(self, hits):
+        """ Post-process a page of raw hits for output """
+        return hits
+
+    @property
+    def facets(self):
+        """ Term and date histogram facet counts from the last search, or None if it didn't ask for any """
+        if not self._results or 'facets' not in self._results:
+            return None
+
+        out = {}
+        for name, facet in self._results['facets'].items():
+            if 'terms' in facet:
+                out[name] = [{'value': term['term'], 'count': term['count']} for term in facet['terms']]
+            elif 'entries' in facet:
+                out[name] = [{
+                    'value': datetime.datetime.utcfromtimestamp(entry['time'] / 1000).date().isoformat(),
+                    'count': entry['count']
+                } for entry in facet['entries']]
+        return out
 
     def __len__(self):
         return self._count
@@ -215,6 +462,10 @@ class MongoSearchResultsView(SearchResultsView):
         self.mongo_query = parsed['quoted_text']
         self.filters = parsed['filters']
 
+    def cache_key(self, *extra):
+        # the first filter picks the sort order for filter-only searches, so here filter order matters too
+        return super(MongoSearchResultsView, self).cache_key(tuple(tuple(f[:2]) for f in self.filters), *extra)
+
 class MongoSearchResults(object):
     model = None
 
@@ -225,6 +476,7 @@ class MongoSearchResults(object):
         self._count = -1
         self.alternative_sort = alternative_sort if alternative_sort else ("_id", 1)
         self.is_filtered = is_filtered
+        self.count_is_estimate = False
 
     def __getslice__(self, start, end):
         model = self.model
@@ -257,58 +509,102 @@ class MongoSearchResults(object):
 
             # this might be a text search or a regular query, depending on whether things besides filters are supplied
             if self.query['search']:
-                self._results = model._get_db().command("text", model._get_collection_name(), **self.query)
-                actual = self._results['results'][actual_start:actual_end]
-
-                actual_fmt = [{
-                    '_id': match['obj']['_id'],
-                    '_type': model._class_name.lower(),
-                    '_index': ES_INDEX,
-                    '_score': match['score'],
-                    '_from_filter': False,
-                    'url': self.get_result_url(match['obj']),
-                    'fields': self.get_result_fields(match['obj'])
-                } for match in actual]
-
-                self._count = len(self.extra_ids) + (len(self._results['results']) if self._results else 0)
+                # only this page's records are fetched; the ranking comes from the (cached) full search
+                ranked = self.get_ranked_ids()
+                actual = ranked[actual_start:actual_end]
+                records = dict((record['_id'], record) for record in model._get_collection().find({'_id': {'$in': [match[0] for match in actual]}}, self.query['project']))
+
+                actual_fmt = [self.format_match(records[match[0]], match[1]) for match in actual if match[0] in records]
+
+                self._count = len(self.extra_ids) + len(ranked)
             else:
                 # build query
                 cursor = model._get_collection().find(self.query['filter'], fields=self.query['project'].keys()).sort(*self.alternative_sort)
                 
                 # get full count
-                self._count = len(self.extra_ids) + cursor.count()
+                self._count = len(self.extra_ids) + self.get_filter_count()
 
                 # fetch subset of results
                 self._results = cursor.skip(actual_start).limit(actual_end - actual_start)
                 actual = list(self._results)
 
-                actual_fmt = [{
-                    '_id': match['_id'],
-                    '_type': model._class_name.lower(),
-                    '_index': ES_INDEX,
-                    '_score': 99, # arbitrary but high, since they come first
-                    '_from_filter': False,
-                    'url': self.get_result_url(match),
-                    'fields': self.get_result_fields(match)
-                } for match in actual]
+                actual_fmt = [self.format_match(match, 99) for match in actual] # arbitrary but high, since they come first
         else:
             actual_fmt = []
         
-        initial_fmt = [{
-            '_id': match['_id'],
-            '_type': model._class_name.lower(),
-            '_index': ES_INDEX,
-            '_score': 100, # arbitrary but high, since they come first
-            '_from_filter': True,
-            'url': self.get_result_url(match),
-            'fields': self.get_result_fields(match)
-        } for match in initial]
+        initial_fmt = [self.format_match(match, 100, from_filter=True) for match in initial] # arbitrary but high, since they come first
 
         return initial_fmt + actual_fmt
 
     def __len__(self):
         return self._count
 
+    def format_match(self, match_object, score, from_filter=False):
+        return {
+            '_id': match_object['_id'],
+            '_type': self.model._class_name.lower(),
+            '_index': ES_INDEX,
+            '_score': score,
+            '_from_filter': from_filter,
+            'url': self.get_result_url(match_object),
+            'fields': self.get_result_fields(match_object)
+        }
+
+    def export_limit(self):
+        # the text command returns every match in one reply, so it can't go past its limit; filter-only searches use a plain cursor, which can
+        if self.query['search'] and len(self.get_ranked_ids()) >= self.query['limit']:
+            return len(self.extra_ids) + self.query['limit']
+        return None
+
+    def export(self, batch_size):
+        """ Every result, in the same order as slicing gives them, reading batch_size records from Mongo at a time """
+        collection = self.model._get_collection()
+
+        for start in xrange(0, len(self.extra_ids), batch_size):
+            for match in collection.find({'_id': {'$in': self.extra_ids[start:start + batch_size]}}, self.query['project']):
+                yield self.format_match(match, 100, from_filter=True)
+
+        if self.query['search']:
+            # the ranking's just IDs and scores, and is usually already cached from the first page
+            ranked = self.get_ranked_ids()
+            for start in xrange(0, len(ranked), batch_size):
+                batch = ranked[start:start + batch_size]
+                records = dict((record['_id'], record) for record in collection.find({'_id': {'$in': [match[0] for match in batch]}}, self.query['project']))
+                for match in batch:
+                    if match[0] in records:
+                        yield self.format_match(records[match[0]], match[1])
+        elif self.is_filtered:
+            for match in collection.find(self.query['filter'], fields=self.query['project'].keys()).sort(*self.alternative_sort).batch_size(batch_size):
+                yield self.format_match(match, 99)
+
+    def get_ranked_ids(self):
+        """ (id, score) for every text search match, best first; kept around so later pages and counts don't rerun the search """
+        model = self.model
+        key = (model._get_collection_name(), self.query['search'], json.dumps(self.query['filter'], sort_keys=True, default=str), self.query['limit'])
+
+        ranked = ranked_id_cache.get(key)
+        if ranked is None:
+            results = model._get_db().command("text", model._get_collection_name(), search=self.query['search'], filter=self.query['filter'], project={'_id': 1}, limit=self.query['limit'])
+            ranked = [(match['obj']['_id'], match['score']) for match in results['results']]
+            ranked_id_cache.set(key, ranked)
+        return ranked
+
+    def get_filter_count(self):
+        """ The number of matches for a filter-only search; these filters usually can't use an index, so counts are kept briefly, and capped if COUNT_ESTIMATE_LIMIT is set """
+        collection = self.model._get_collection()
+        key = (collection.name, json.dumps(self.query['filter'], sort_keys=True, default=str))
+
+        count = count_cache.get(key)
+        if count is None:
+            cursor = collection.find(self.query['filter'], fields=['_id'])
+            if COUNT_ESTIMATE_LIMIT:
+                cursor = cursor.limit(COUNT_ESTIMATE_LIMIT)
+            count = cursor.count(with_limit_and_skip=True)
+            count_cache.set(key, count)
+
+        self.count_is_estimate = bool(COUNT_ESTIMATE_LIMIT) and count >= COUNT_ESTIMATE_LIMIT
+        return count
+
     def get_result_fields(self, match_object):
         return {}
 
@@ -320,27 +616,35 @@ class MongoSearchResults(object):
 class DocumentSearchResults(ESSearchResults):
     doc_types = ["document"]
 
-    def __getslice__(self, start, end):
-        s = super(DocumentSearchResults, self).__getslice__(start, end)
+    # the order highlights are shown in; any other fields come after these
+    highlight_order = ['identifiers', 'title', 'files.text']
 
-        def stitch_record(match):
+    def stitch(self, s):
+        for match in s:
             match['url'] = reverse('document-view', kwargs={'document_id': match['_id']})
 
-            if match.get('highlight', None):
+            highlight = match.get('highlight', None)
+            if highlight:
                 # munge the highlights so the frontend doesn't have to care what field they came from
-                ordered = sorted(match['highlight'].items(), key=lambda x: ['identifiers', 'title', 'files.text'].index(x[0]))
-                collated = [[(row[0], snippet) for snippet in row[1]] for row in ordered]
-                collapsed = reduce(operator.add, collated)
-                formatted = ["<strong>ID:</strong> %s" % item[1] if item[0] == 'identifiers' else item[1] for item in collapsed]
+                fields = self.highlight_order + [field for field in highlight if field not in self.highlight_order]
+
+                formatted = []
+                for field in fields:
+                    for snippet in highlight.get(field, ()):
+                        formatted.append("<strong>ID:</strong> %s" % snippet if field == 'identifiers' else snippet)
                 match['highlight'] = formatted
-            
-            return match
 
-        return map(stitch_record, s)
+        return s
 
 class DocumentSearchResultsView(ESSearchResultsView):
     aggregation_level = 'document'
     allowed_filters = ['agency', 'docket', 'submitter', 'mentioned', 'type', 'comment_on', 'date']
+    export_fields = ['document_type', 'docket_id', 'title', 'submitter_name', 'submitter_organization', 'agency', 'posted_date']
+    facet_definitions = {
+        'agency': {'terms': {'field': 'agency', 'size': 25}},
+        'type': {'terms': {'field': 'document_type', 'size': 10}},
+        'month': {'date_histogram': {'field': 'posted_date', 'interval': 'month'}}
+    }
 
     def get_results(self):
         query = {}
@@ -354,9 +658,14 @@ class DocumentSearchResultsView(ESSearchResultsView):
         if text_query:
             query['query'] = text_query
             if 'query_string' in text_query:
-                query['highlight'] = {'fields': dict([(field.split('^')[0], {}) for field in text_query['query_string']['fields']])}
+                query['highlight'] = {
+                    'number_of_fragments': HIGHLIGHT_FRAGMENTS,
+                    'fragment_size': HIGHLIGHT_FRAGMENT_SIZE,
+                    'fields': dict([(field.split('^')[0], {}) for field in text_query['query_string']['fields']])
+                }
 
-        query['fields'] = ['document_type', 'docket_id', 'title', 'submitter_name', 'submitter_organization', 'agency', 'posted_date']
+        query['fields'] = self.export_fields
+        self.add_facets(query)
         
         return DocumentSearchResults(query)
 
@@ -378,6 +687,9 @@ class NonFRSearchResultsView(DocumentSearchResultsView):
 
 class DocketSearchResultsView(ESSearchResultsView):
     aggregation_level = 'docket'
+    facet_definitions = {
+        'agency': {'terms': {'field': 'agency', 'size': 25}}
+    }
 
     def get_results(self):
         query = {}
@@ -414,52 +726,24 @@ class DocketSearchResultsView(ESSearchResultsView):
         }
 
         query['fields'] = ['_id', 'title', 'agency']
+        self.add_facets(query)
 
         return DocketSearchResults(query)
 
 class DocketSearchResults(ESSearchResults):
     doc_types = ["docket"]
 
-    def __getslice__(self, start, end):
-        s = super(DocketSearchResults, self).__getslice__(start, end)
-
-        # get some extra info from Mongo
-        db = Doc._get_db()
+    # the enrichment calls only decorate results, so if one is slow the page goes out without its part
+    mongo_timeout = getattr(settings, 'SEARCH_MONGO_TIMEOUT', 5.0)
+    es_timeout = getattr(settings, 'SEARCH_ES_TIMEOUT', es_pool.ES_TIMEOUT)
 
+    def stitch(self, s):
+        # the Mongo and ES lookups only depend on the IDs, so run them side by side
         ids = [match['_id'] for match in s]
-        agg_search = db.dockets.find({'_id': {'$in': ids}}, ['_id', 'name', 'year', 'title', 'details', 'agency', 'stats'])
-        agg_map = dict([(result['_id'], result) for result in agg_search])
-
-        # get some extra info from ES
-        if ids:
-            count_query = {
-                'query': [query for query in self.query['query']['dis_max']['queries'] if 'has_child' in query][0]['has_child']['query'],
-                'facets': {'dockets': {'terms': {'field': 'docket_id', 'size': len(ids)}}},
-                'size': 0
-            }
-            
-            hp_filter = {
-                'has_parent': {
-                    'type': 'docket',
-                    'filter': {
-                        'ids': {'values': ids}
-                    }
-                }
-            }
-            if 'filter' in self.query:
-                count_query['facets']['dockets']['facet_filter'] = {
-                    'and': [
-                        self.query['filter']['has_child']['filter'],
-                        hp_filter
-                    ]
-                }
-            else:
-                count_query['facets']['dockets']['facet_filter'] = hp_filter
-
-            child_results = self.es.search_raw(count_query, indices=self.indices, doc_types=['document'])
-            child_counts = dict([(term['term'], term['count']) for term in child_results['facets']['dockets']['terms']])
-        else:
-            child_counts = {}
+        agg_map, child_counts = fan_out(
+            (self.get_docket_records, (ids,), self.mongo_timeout, {}),
+            (self.get_child_counts, (ids,), self.es_timeout, {})
+        ) if ids else ({}, {})
 
         def stitch_record(match):
             match['url'] = reverse('docket-view', kwargs={'docket_id': match['_id']})
@@ -476,7 +760,7 @@ class DocketSearchResults(ESSearchResults):
                 
                 rulemaking_field = agg_data.get('details', {}).get('dk_type', None)
                 if rulemaking_field:
-                    out['fields']['rulemaking'] = rulemaking_field.lower() == 'rulemaking'
+                    match['fields']['rulemaking'] = rulemaking_field.lower() == 'rulemaking'
 
             match['fields']['matched'] = child_counts.get(match['_id'], 0)
             
@@ -484,12 +768,49 @@ class DocketSearchResults(ESSearchResults):
 
         return map(stitch_record, s)
 
+    def get_docket_records(self, ids):
+        """Extra info from Mongo for the given dockets, by ID."""
+        db = Doc._get_db()
+
+        agg_search = db.dockets.find({'_id': {'$in': ids}}, ['_id', 'name', 'year', 'title', 'details', 'agency', 'stats'])
+        return dict([(result['_id'], result) for result in agg_search])
+
+    def get_child_counts(self, ids):
+        """The number of matching documents in each of the given dockets, from ES."""
+        count_query = {
+            'query': [query for query in self.query['query']['dis_max']['queries'] if 'has_child' in query][0]['has_child']['query'],
+            'facets': {'dockets': {'terms': {'field': 'docket_id', 'size': len(ids)}}},
+            'size': 0
+        }
+
+        hp_filter = {
+            'has_parent': {
+                'type': 'docket',
+                'filter': {
+                    'ids': {'values': ids}
+                }
+            }
+        }
+        if 'filter' in self.query:
+            count_query['facets']['dockets']['facet_filter'] = {
+                'and': [
+                    self.query['filter']['has_child']['filter'],
+                    hp_filter
+                ]
+            }
+        else:
+            count_query['facets']['dockets']['facet_filter'] = hp_filter
+
+        child_results = es_pool.search_raw(count_query, indices=self.indices, doc_types=['document'])
+        return dict([(term['term'], term['count']) for term in child_results['facets']['dockets']['terms']])
+
 class EntitySearchResultsView(MongoSearchResultsView):
     aggregation_level = 'entity'
 
     # filters for entities are a little weird -- 'submitter' and 'mentioned' are synonymous, and not actually filters, but just add the entities to the results
     # unadorned 'agency' and 'docket' filter entities by submission to that agency/docket, and with '_mentioned', filter by mention in that agency/docket
     allowed_filters = ['agency', 'agency_mentioned', 'docket', 'docket_mentioned', 'submitter', 'mentioned']
+    export_fields = ['name', 'type', 'submitter_count', 'text_count']
 
     def get_results(self):
         extra_ids = []
@@ -605,10 +926,110 @@ class DefaultSearchResultsView(APIView):
 
         return Response(status=status.HTTP_302_FOUND, headers={'Location': new_url})
 
-def get_similar_dockets(text, exclude_docket):
-    es = pyes.ES(settings.ES_SETTINGS)
+class BatchSearchResultsView(APIView):
+    """ One query at several aggregation levels in one request: the ES-backed levels go out as a single msearch, and the Mongo-backed ones run alongside it """
+    levels = [
+        ('document', 'search-documents-view', DocumentSearchResultsView),
+        ('document-fr', 'search-fr-documents-view', FRSearchResultsView),
+        ('document-non-fr', 'search-non-fr-documents-view', NonFRSearchResultsView),
+        ('docket', 'search-dockets-view', DocketSearchResultsView),
+        ('entity', 'search-entity-view', EntitySearchResultsView),
+        ('agency', 'search-agency-view', AgencySearchResultsView)
+    ]
+    timeout = getattr(settings, 'BATCH_SEARCH_TIMEOUT', 30.0)
+
+    def get(self, request, query):
+        levels = dict((name, (url_name, view_class)) for name, url_name, view_class in self.levels)
+        names = [name for name in request.GET.get('levels', '').split(',') if name] or [level[0] for level in self.levels]
+        unknown = [name for name in names if name not in levels]
+        if unknown:
+            return Response({'error': 'Unknown aggregation levels: %s' % ', '.join(unknown)}, status=status.HTTP_400_BAD_REQUEST)
+        names = uniq(names)
+
+        # set up a view per level as though it had been asked directly, so paging, caching and serialization all work as usual
+        views = {}
+        for name in names:
+            url_name, view_class = levels[name]
+            view = view_class(request=request, args=(), kwargs={'query': query})
+            view.path = reverse(url_name, kwargs={'query': query})
+            view.set_query(query)
+            views[name] = view
+
+        pages = {}
+        es_pending, mongo_pending = [], []
+        for name in names:
+            page = search_cache.get(views[name].page_cache_key())
+            if page is not None:
+                pages[name] = page
+                continue
+
+            all_results = views[name].get_results()
+            (es_pending if isinstance(all_results, ESSearchResults) else mongo_pending).append((name, all_results))
+
+        def run_msearch():
+            return es_pool.msearch([all_results.search_request(*views[name].page_bounds()[1:]) for name, all_results in es_pending])
+
+        # what a call gives back instead of its result if it ran out of time or raised
+        timed_out, failed = object(), object()
+        def error_for(result):
+            return 'Search timed out.' if result is timed_out else 'Search failed.' if result is failed else None
+
+        def failsafe(func, description):
+            # fan_out re-raises, and one failed level shouldn't take the others down with it
+            def call(*args):
+                try:
+                    return func(*args)
+                except Exception:
+                    log.exception("Batch search for %r failed: %s", query, description)
+                    return failed
+            return call
+
+        calls = [(failsafe(views[name].fetch_page, name), (all_results,), self.timeout, timed_out) for name, all_results in mongo_pending]
+        if es_pending:
+            calls.append((failsafe(run_msearch, 'msearch'), (), self.timeout, timed_out))
+        fetched = fan_out(*calls)
+        mongo_pages = fetched[:len(mongo_pending)]
+        es_responses = fetched[-1] if es_pending else []
+
+        level_errors = {}
+        if error_for(es_responses):
+            level_errors.update((name, error_for(es_responses)) for name, all_results in es_pending)
+            es_responses = []
+
+        # stitching can make further backend calls of its own, so it happens back here rather than in the pool
+        for (name, all_results), response in zip(es_pending, es_responses):
+            if 'error' in response:
+                log.error("Batch search for %r failed: %s: %s", query, name, response['error'])
+                level_errors[name] = error_for(failed)
+                continue
+            try:
+                all_results.set_results(response)
+                pages[name] = views[name].fetch_page(all_results)
+            except Exception:
+                log.exception("Batch search for %r failed: %s", query, name)
+                level_errors[name] = error_for(failed)
+        for (name, all_results), page in zip(mongo_pending, mongo_pages):
+            if error_for(page):
+                level_errors[name] = error_for(page)
+            else:
+                pages[name] = page
+
+        timed_out_levels = [name for name in names if level_errors.get(name) == error_for(timed_out)]
+        if timed_out_levels:
+            log.warning("Batch search for %r timed out after %ss: %s", query, self.timeout, ', '.join(timed_out_levels))
 
-    results = es.search_raw({
+        out = {'query': query, 'results': {}}
+        for name in names:
+            if name in pages:
+                search_cache.set(views[name].page_cache_key(), pages[name])
+                out['results'][name] = views[name].serialize_page(pages[name])
+            else:
+                out['results'][name] = {'error': level_errors[name]}
+
+        return Response(out)
+
+def get_similar_dockets(text, exclude_docket):
+    results = es_pool.search_raw({
         'query': {
             'more_like_this': {
                 'fields': ['files.text'],
@@ -0,0 +1,52 @@
+"""Similar-docket recommendations.
+
+Finding similar dockets means a more_like_this query over the text of a
+docket's Federal Register documents, which is the slowest part of the docket
+page.  The compute_similar_dockets command does that offline and stores the
+results in a side collection; docket pages read the stored list and only fall
+back to a live (cached) query for dockets that haven't been computed yet.
+"""
+from django.conf import settings
+
+from regs_models import Doc
+from search import get_similar_dockets
+from cache import cache
+
+import datetime
+
+SIMILAR_DOCKETS_COLLECTION = getattr(settings, 'SIMILAR_DOCKETS_COLLECTION', 'similar_dockets')
+
+def _collection():
+    return Doc._get_db()[SIMILAR_DOCKETS_COLLECTION]
+
+def fr_doc_summary(fr_doc):
+    """The text a Federal Register document contributes to its docket's similarity query."""
+    summary = fr_doc.annotations['fr_data'].get('abstract', None) if fr_doc.annotations.get('fr_data', None) else None
+    return summary or fr_doc.get_summary()
+
+def docket_summary_text(docket):
+    """The similarity query text for a docket, built the same way the docket page builds it."""
+    fr_doc_ids = [doc['id'] for doc in docket.stats.get('doc_info', {}).get('fr_docs', [])]
+    fr_docs = dict([(fr_doc.id, fr_doc) for fr_doc in Doc.objects(id__in=fr_doc_ids)])
+
+    summaries = [fr_doc_summary(fr_docs[doc_id]) for doc_id in fr_doc_ids if doc_id in fr_docs]
+    return "\n".join([summary for summary in summaries if summary])
+
+def store_similar_dockets(docket_id, similar):
+    _collection().save({'_id': docket_id, 'similar': similar, 'computed': datetime.datetime.now()})
+
+def stored_similar_dockets(docket_id):
+    """The precomputed similar docket IDs for a docket, or None if they haven't been computed."""
+    record = _collection().find_one({'_id': docket_id}, ['similar'])
+    return record['similar'] if record else None
+
+@cache(getattr(settings, 'SIMILAR_DOCKETS_CACHE_TIMEOUT', 86400))
+def live_similar_dockets(text, docket_id):
+    return get_similar_dockets(text, docket_id)
+
+def find_similar_dockets(docket_id, text):
+    """Similar docket IDs for a docket, best first: the stored list if there is one, otherwise a cached live query on `text`."""
+    similar = stored_similar_dockets(docket_id)
+    if similar is None:
+        similar = live_similar_dockets(text, docket_id) if text else []
+    return similar
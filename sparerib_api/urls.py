@@ -2,9 +2,11 @@ from django.conf.urls import patterns, url
 from django.views.decorators.cache import cache_page
 from views import AgencyView, DocketView, DocumentView, EntityView, EntityDocketView, EntitySummaryView, RawTextView, FileProxyView, NotFoundView
 
-from search import DocumentSearchResultsView, FRSearchResultsView, NonFRSearchResultsView, DocketSearchResultsView, EntitySearchResultsView, AgencySearchResultsView, DefaultSearchResultsView
+from search import DocumentSearchResultsView, FRSearchResultsView, NonFRSearchResultsView, DocketSearchResultsView, EntitySearchResultsView, AgencySearchResultsView, DefaultSearchResultsView, BatchSearchResultsView
 
-from clustering import DocketHierarchyView, SingleClusterView, DocumentClusterView, DocumentClusterChainView, HierarchyTeaserView
+from clustering import DocketHierarchyView, SingleClusterView, DocumentClusterView, DocumentClusterChainView, HierarchyTeaserView, ClusterCutView
+
+from autocomplete import AutocompleteView
 
 HOUR_CACHE = cache_page(3600)
 
@@ -25,8 +27,12 @@ urlpatterns = patterns('',
     url(r'^search/docket/(?P<query>.*$)', DocketSearchResultsView.as_view(), name='search-dockets-view'),
     url(r'^search/agency/(?P<query>.*$)', AgencySearchResultsView.as_view(), name='search-agency-view'),
     url(r'^search/entity/(?P<query>.*$)', EntitySearchResultsView.as_view(), name='search-entity-view'),
+    url(r'^search-batch/(?P<query>.*$)', BatchSearchResultsView.as_view(), name='search-batch-view'),
     url(r'^search/(?P<query>.*$)', DefaultSearchResultsView.as_view(), name='search-default-view'),
 
+    # autocomplete
+    url(r'^ac$', AutocompleteView.as_view(), name='autocomplete'),
+
     # raw text and documents
     url(r'^document/(?P<document_id>[A-Z0-9_-]+)/view_(?P<file_type>[0-9a-z]+)\.(?P<output_format>[0-9a-z]+)$', RawTextView.as_view(), name='raw-text-view', kwargs={'view_type': 'view'}),
     url(r'^document/(?P<document_id>[A-Z0-9_-]+)/attachment_(?P<object_id>[A-Z0-9a-z]+)/view_(?P<file_type>[0-9a-z]+)\.(?P<output_format>[0-9a-z]+)$', RawTextView.as_view(), name='raw-text-view', kwargs={'view_type': 'attachment'}),
@@ -34,6 +40,7 @@ urlpatterns = patterns('',
 
     # clusters
     url(r'^docket/(?P<docket_id>[A-Z0-9_-]+)/hierarchy$', DocketHierarchyView.as_view(), name='docket-hierarchy'),
+    url(r'^docket/(?P<docket_id>[A-Z0-9_-]+)/clusters$', ClusterCutView.as_view(), name='cluster-cut'),
     url(r'^docket/(?P<docket_id>[A-Z0-9_-]+)/cluster/(?P<cluster_id>\d+)$', SingleClusterView.as_view(), name='single-cluster'),
     url(r'^docket/(?P<docket_id>[A-Z0-9_-]+)/cluster/(?P<cluster_id>\d+)/document/(?P<document_id>\d+)$', DocumentClusterView.as_view(), name='document-cluster'),
     url(r'^docket/(?P<docket_id>[A-Z0-9_-]+)/clusters_for_document/(?P<document_id>\d+)$', DocumentClusterChainView.as_view(), name='document-cluster'),
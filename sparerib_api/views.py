@@ -10,7 +10,7 @@ from django.views.generic import View
 from django.core.urlresolvers import reverse
 
 from util import *
-from search import get_similar_dockets
+from similar import fr_doc_summary, find_similar_dockets
 
 from regs_models import Doc, Docket, Agency, Entity
 from mongoengine import Q
@@ -152,11 +152,7 @@ class DocketView(AggregatedView):
                             'count': fr_doc.stats['count']
                         } if fr_doc.stats else {'count': 0}
                         
-                        if fr_doc.annotations.get('fr_data', None):
-                            doc['summary'] = fr_doc.annotations['fr_data'].get('abstract', None)
-
-                        if not doc.get('summary', None):
-                            doc['summary'] = fr_doc.get_summary()
+                        doc['summary'] = fr_doc_summary(fr_doc)
 
                         doc['comments_open'] = 'Comment_Due_Date' in fr_doc.details and force_date(fr_doc.details['Comment_Due_Date']) > datetime.datetime.now()
 
@@ -176,14 +172,13 @@ class DocketView(AggregatedView):
                         included.add(doc['id'])
 
             summary_text = "\n".join(summaries)
-            if summary_text:
-                similar_dockets = get_similar_dockets(summary_text, kwargs[self.aggregation_field])[:3]
-                if similar_dockets:
-                    sd = dict([(docket.id, docket.title) for docket in Docket.objects(id__in=similar_dockets).only('id', 'title')])
-                    stats['similar_dockets'] = [{
-                        'id': docket,
-                        'title': sd[docket]
-                    } for docket in similar_dockets]
+            similar_dockets = find_similar_dockets(kwargs[self.aggregation_field], summary_text)[:3]
+            if similar_dockets:
+                sd = dict([(docket.id, docket.title) for docket in Docket.objects(id__in=similar_dockets).only('id', 'title')])
+                stats['similar_dockets'] = [{
+                    'id': docket,
+                    'title': sd[docket]
+                } for docket in similar_dockets if docket in sd]
 
         agency = self.item.agency
         if not agency:
@@ -239,7 +239,7 @@ var SearchView = Backbone.View.extend({
                 if (request.term.length == 0) {
                     response([]);
                 } else {
-                    $.getJSON(AC_URL + request.term, function(data) {
+                    $.getJSON(requireKey(function() { return AC_URL + request.term; })(), function(data) {
                         response(data.matches);
                     });
                 }
@@ -297,7 +297,7 @@ var SearchView = Backbone.View.extend({
                         response([]);
                     } else {
                         var tf = {'agency': 'a', 'submitter': 'o'};
-                        $.getJSON(AC_URL + request.term + "&type=" + tf[filterType], function(data) {
+                        $.getJSON(requireKey(function() { return AC_URL + request.term + "&type=" + tf[filterType]; })(), function(data) {
                             response(data.matches);
                         });
                     }
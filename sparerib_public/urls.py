@@ -5,7 +5,7 @@ from django.views.generic import TemplateView
 class IndexView(TemplateView):
     template_name = "sparerib/index.html"
     def get_context_data(self):
-        return {"AC_URL": getattr(settings, "AC_URL", "/ac?term=")}
+        return {"AC_URL": getattr(settings, "AC_URL", "/api/1.0/ac?term=")}
 
 urlpatterns = patterns('',
     url(r'', IndexView.as_view())
@@ -84,3 +84,11 @@ try:
 except:
     pass
 
+# keep connections to the analysis database open between requests (see sparerib_api/postgres/base.py);
+# POOL_SIZE on its DATABASES entry caps the idle connections each process keeps (10 by default),
+# and POOL_DB_CONNECTIONS = False in local_settings turns pooling off
+ANALYSIS_DATABASE = globals().get('ANALYSIS_DATABASE', 'default')
+if globals().get('POOL_DB_CONNECTIONS', True) and ANALYSIS_DATABASE in globals().get('DATABASES', {}):
+    if DATABASES[ANALYSIS_DATABASE].get('ENGINE') == 'django.db.backends.postgresql_psycopg2':
+        DATABASES[ANALYSIS_DATABASE]['ENGINE'] = 'sparerib_api.postgres'
+
@@ -23,6 +23,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sparerib_server.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# load the prebuilt autocomplete index now rather than on some worker's first keystroke
+from sparerib_api.autocomplete import load_index
+load_index()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)